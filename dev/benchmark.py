@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark of the plugin views
+
+Requests the Status, Devices, Sites and Job Status views concurrently through
+the complete Django request stack of a NetBox installation with the plugin,
+and reports p50/p95/p99 latency, throughput and SQL queries per view.
+
+Run from the NetBox directory (the one with manage.py) against the stand-in
+Cisco DNA Center of `dev/fake_dnac.py`:
+
+    cd /opt/netbox/netbox
+    python3 /path/to/dev/benchmark.py --dnac 127.0.0.1:8443 --requests 200 --concurrency 8
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+VIEWS = ["status", "devices", "sites", "job_status"]
+
+
+def setup():
+    sys.path.insert(0, os.getcwd())
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "netbox.settings")
+    import django
+
+    django.setup()
+
+
+def controller(hostname):
+    """
+    Settings entry of the stand-in Cisco DNA Center
+    """
+    from netbox_ciscodnac_plugin.models import Settings
+
+    tenant, _ = Settings.objects.update_or_create(
+        hostname=hostname,
+        defaults={
+            "username": "benchmark",
+            "password": "benchmark",
+            "version": "2.3.7.6",
+            "verify": False,
+            "status": True,
+        },
+    )
+    return tenant
+
+
+def job():
+    """
+    ID of an RQ Job to poll
+    """
+    from django_rq import get_queue
+
+    return get_queue("default").enqueue(len, []).id
+
+
+def urls(pk, job_id):
+    from django.urls import reverse
+
+    name = "plugins:netbox_ciscodnac_plugin:{}"
+    return {
+        "status": reverse(name.format("status")),
+        "devices": reverse(name.format("devices"), kwargs={"pk": pk}),
+        "sites": reverse(name.format("sites"), kwargs={"pk": pk}),
+        "job_status": reverse(name.format("job_status"), kwargs={"id": job_id}),
+    }
+
+
+class Worker:
+    """
+    Logged in test client and query counter of a thread
+    """
+
+    def __init__(self, user, host):
+        from django.db import connection
+        from django.test import Client
+
+        self.client = Client(HTTP_HOST=host)
+        self.client.force_login(user)
+        self.queries = 0
+        # Thread local connection, counts every query of the requests
+        connection.execute_wrappers.append(self.count)
+
+    def count(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def request(worker, url):
+    """
+    Latency (seconds), status code and SQL queries of one request
+    """
+    worker.queries = 0
+    started = time.perf_counter()
+    response = worker.client.get(url)
+    if hasattr(response, "streaming_content"):
+        for _ in response.streaming_content:
+            pass
+    return time.perf_counter() - started, response.status_code, worker.queries
+
+
+def run(url, requests, concurrency, worker):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: request(worker(), url), range(requests)))
+    duration = time.perf_counter() - started
+    return results, duration
+
+
+def report(view, results, duration):
+    latency = sorted(r[0] * 1000 for r in results)
+    errors = len([r for r in results if r[1] >= 400])
+    queries = [r[2] for r in results]
+    if len(latency) > 1:
+        q = statistics.quantiles(latency, n=100, method="inclusive")
+        p50, p95, p99 = q[49], q[94], q[98]
+    else:
+        p50 = p95 = p99 = latency[0]
+    print(
+        "{:<12} {:>8.1f} {:>8.1f} {:>8.1f} {:>9.1f} {:>8.1f} {:>7} {:>7}".format(
+            view,
+            p50,
+            p95,
+            p99,
+            len(results) / duration,
+            statistics.mean(queries),
+            max(queries),
+            errors,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dnac", default="127.0.0.1:8443", help="hostname[:port]")
+    parser.add_argument("--views", nargs="+", choices=VIEWS, default=VIEWS)
+    parser.add_argument("--requests", type=int, default=100, help="per view")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=2, help="requests per view")
+    parser.add_argument("--username", default="benchmark")
+    parser.add_argument("--host", default="localhost", help="HTTP Host header")
+    args = parser.parse_args()
+
+    setup()
+    from django.contrib.auth import get_user_model
+    from django.db import close_old_connections
+
+    user, created = get_user_model().objects.get_or_create(username=args.username)
+    if created:
+        user.is_superuser = True
+        user.is_staff = True
+        user.save()
+
+    tenant = controller(args.dnac)
+    targets = urls(tenant.pk, job())
+
+    # One client per thread of the pool
+    local = threading.local()
+
+    def worker():
+        if not hasattr(local, "worker"):
+            local.worker = Worker(user, args.host)
+        return local.worker
+
+    print(
+        "{:<12} {:>8} {:>8} {:>8} {:>9} {:>8} {:>7} {:>7}".format(
+            "view", "p50 ms", "p95 ms", "p99 ms", "req/s", "queries", "max", "errors"
+        )
+    )
+    for view in args.views:
+        run(targets[view], args.warmup, 1, worker)
+        results, duration = run(targets[view], args.requests, args.concurrency, worker)
+        report(view, results, duration)
+        close_old_connections()
+
+
+if __name__ == "__main__":
+    main()
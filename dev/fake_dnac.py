@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Stand-in Cisco DNA Center for load tests
+
+Serves the Intent API calls used by the plugin (token, network-device, site,
+site count, membership, interface) from a generated inventory of configurable
+size, over HTTPS with a self-signed certificate.
+
+    python3 dev/fake_dnac.py --port 8443 --areas 4 --buildings 10 --floors 3 \\
+        --devices 5000 --interfaces 24 --latency 50
+
+Add a Settings entry with hostname `127.0.0.1:8443`, any username/password and
+certificate verification disabled.
+"""
+import argparse
+import json
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class Inventory:
+    """
+    Generated Cisco DNA Center inventory
+    """
+
+    def __init__(self, areas, buildings, floors, devices, interfaces, seed="dnac"):
+        self.namespace = uuid.uuid5(uuid.NAMESPACE_DNS, seed)
+        self.sites = []
+        self.devices = []
+        self.interfaces = []
+        self.members = {}
+
+        glob = self.site("Global", None, "Global", None)
+        floor_ids = []
+        for a in range(areas):
+            area = self.site("Area-{}".format(a), glob, None, "area")
+            for b in range(buildings):
+                building = self.site(
+                    "Building-{}-{}".format(a, b), area, None, "building"
+                )
+                for f in range(floors):
+                    floor = self.site("Floor-{}".format(f), building, None, "floor")
+                    floor_ids.append(floor["id"])
+                if floors == 0:
+                    floor_ids.append(building["id"])
+
+        for d in range(devices):
+            device = {
+                "id": self.uuid("device", d),
+                "hostname": "sw-{:06d}.example.com".format(d),
+                "serialNumber": "FAKE{:08d}".format(d),
+                "managementIpAddress": "10.{}.{}.{}".format(
+                    (d >> 16) & 255, (d >> 8) & 255, d & 255
+                ),
+                "platformId": "C9300-48P",
+                "softwareVersion": "17.9.4",
+                "family": "Switches and Hubs",
+                "series": "Cisco Catalyst 9300 Series Switches",
+                "type": "Cisco Catalyst 9300 Switch",
+                "role": "ACCESS",
+                "reachabilityStatus": "Reachable",
+                "collectionStatus": "Managed",
+                "deviceSupportLevel": "Supported",
+                "upTime": "12 days, 3:04:05.00",
+                "lastUpdated": "2024-01-01 00:00:00",
+            }
+            self.devices.append(device)
+            if floor_ids:
+                site = floor_ids[d % len(floor_ids)]
+                self.members.setdefault(site, []).append(device)
+            for i in range(interfaces):
+                self.interfaces.append(
+                    {
+                        "id": self.uuid("interface", d * 100000 + i),
+                        "deviceId": device["id"],
+                        "portName": "GigabitEthernet1/0/{}".format(i + 1),
+                        "interfaceType": "Physical",
+                        "adminStatus": "UP",
+                        "status": "up",
+                        "speed": "1000000",
+                        "mtu": "1500",
+                        "description": "",
+                    }
+                )
+
+    def uuid(self, kind, index):
+        return str(uuid.uuid5(self.namespace, "{}-{}".format(kind, index)))
+
+    def site(self, name, parent, hierarchy, type):
+        if hierarchy is None:
+            hierarchy = "{}/{}".format(parent["siteNameHierarchy"], name)
+        site = {
+            "id": self.uuid("site", len(self.sites)),
+            "name": name,
+            "parentId": parent["id"] if parent else None,
+            "siteNameHierarchy": hierarchy,
+            "additionalInfo": [],
+        }
+        if type is not None:
+            site["additionalInfo"].append(
+                {
+                    "nameSpace": "Location",
+                    "attributes": {
+                        "type": type,
+                        "address": None,
+                        "latitude": None,
+                        "longitude": None,
+                        "country": "United States",
+                    },
+                }
+            )
+        self.sites.append(site)
+        return site
+
+
+def page(items, query):
+    """
+    Slice of a collection with the 1-based `offset` and `limit` of the API
+    """
+    offset = max(int(query.get("offset", ["1"])[0]), 1)
+    limit = min(int(query.get("limit", ["500"])[0]), 500)
+    return items[offset - 1 : offset - 1 + limit]
+
+
+class Handler(BaseHTTPRequestHandler):
+    inventory = None
+    latency = 0.0
+    requests = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        if urlparse(self.path).path == "/dna/system/api/v1/auth/token":
+            return self.reply(200, {"Token": uuid.uuid4().hex})
+        return self.reply(404, {"error": "not found"})
+
+    def do_GET(self):
+        with Handler.lock:
+            Handler.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        inventory = self.inventory
+
+        if url.path == "/dna/intent/api/v1/network-device":
+            devices = inventory.devices
+            for param, field in [
+                ("id", "id"),
+                ("serialNumber", "serialNumber"),
+                ("managementIpAddress", "managementIpAddress"),
+            ]:
+                if param in query:
+                    devices = [d for d in devices if d[field] in query[param]]
+            return self.reply(200, {"response": page(devices, query), "version": "1.0"})
+
+        if url.path == "/dna/intent/api/v1/site/count":
+            return self.reply(200, {"response": len(inventory.sites), "version": "1.0"})
+
+        if url.path == "/dna/intent/api/v1/site":
+            sites = inventory.sites
+            if "siteId" in query:
+                sites = [s for s in sites if s["id"] in query["siteId"]]
+            if "name" in query:
+                sites = [s for s in sites if s["siteNameHierarchy"] in query["name"]]
+            return self.reply(200, {"response": page(sites, query), "version": "1.0"})
+
+        if url.path.startswith("/dna/intent/api/v1/membership/"):
+            site = url.path.rsplit("/", 1)[-1]
+            return self.reply(
+                200,
+                {
+                    "site": {"response": [], "version": "1.0"},
+                    "device": [
+                        {
+                            "response": inventory.members.get(site, []),
+                            "siteId": site,
+                        }
+                    ],
+                },
+            )
+
+        if url.path == "/dna/intent/api/v1/interface":
+            return self.reply(
+                200, {"response": page(inventory.interfaces, query), "version": "1.0"}
+            )
+
+        return self.reply(404, {"error": "not found"})
+
+
+def certificate(directory):
+    """
+    Self-signed certificate for localhost (requires the openssl binary)
+    """
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-keyout", key, "-out", cert, "-days", "1", "-subj", "/CN=localhost",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--areas", type=int, default=2)
+    parser.add_argument("--buildings", type=int, default=5, help="per area")
+    parser.add_argument("--floors", type=int, default=2, help="per building")
+    parser.add_argument("--devices", type=int, default=500)
+    parser.add_argument("--interfaces", type=int, default=0, help="per device")
+    parser.add_argument("--latency", type=float, default=0, help="ms per GET")
+    parser.add_argument("--cert", help="PEM certificate (default: self-signed)")
+    parser.add_argument("--key", help="PEM private key")
+    args = parser.parse_args()
+
+    Handler.inventory = Inventory(
+        args.areas, args.buildings, args.floors, args.devices, args.interfaces
+    )
+    Handler.latency = args.latency / 1000.0
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.cert:
+            cert, key = args.cert, args.key
+        else:
+            cert, key = certificate(directory)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+
+        server = ThreadingHTTPServer((args.host, args.port), Handler)
+        server.daemon_threads = True
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        print(
+            "Fake Cisco DNA Center on https://{}:{} ({} sites, {} devices, {} interfaces)".format(
+                args.host,
+                args.port,
+                len(Handler.inventory.sites),
+                len(Handler.inventory.devices),
+                len(Handler.inventory.interfaces),
+            ),
+            flush=True,
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print("{} API requests served".format(Handler.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,25 @@ class CiscoDNACenterConfig(PluginConfig):
     author = App._AUTHOR_
     author_email = App._EMAIL_
     required_settings = []
-    default_settings = {}
+    default_settings = {
+        "batch_changelog": False,
+        "batch_size": 500,
+        "site_hierarchy": False,
+        "webhook_secret": None,
+        "concurrency": 4,
+        "token_ttl": 3300,
+        "progress_every": 100,
+        "result_retention": 7,
+        "page_time": 10,
+        "page_bytes": 4194304,
+        "interfaces": False,
+        "custom_fields": {},
+        "request_timeout": 30,
+        "breaker_failures": 3,
+        "breaker_cooldown": 300,
+        "deadlines": {"sites": 240, "devices": 480, "interfaces": 120},
+        "queues": {"high": "high", "normal": "default", "low": "low"},
+    }
     base_url = "netbox_ciscodnac_plugin"
     caching_config = {}
 
@@ -12,5 +12,17 @@ class SettingsForm(NetBoxModelForm):
             "version",
             "verify",
             "status",
+            "priority",
+            "page_size",
+            "page_size_min",
+            "page_size_max",
+            "page_time",
         ]
+        labels = {
+            "priority": "Priority (lowest owns Devices seen on several controllers)",
+            "page_size": "Initial page size",
+            "page_size_min": "Minimum page size",
+            "page_size_max": "Maximum page size",
+            "page_time": "Target seconds per page",
+        }
     
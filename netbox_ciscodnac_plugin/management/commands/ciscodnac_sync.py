@@ -0,0 +1,172 @@
+import time
+import uuid
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from ...models import Settings
+from ...netbox_ciscodnac_plugin import CiscoDNAC, Inventory
+from ...netbox_ciscodnac_plugin.data import Data
+from ...netbox_ciscodnac_plugin.utilities import System
+
+
+class Command(BaseCommand):
+    help = "Sync Cisco DNA Center Sites, Devices and Interfaces without RQ workers"
+
+    phases = ["sites", "devices", "interfaces"]
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--controller",
+            help="Settings ID or hostname of a Cisco DNA Center (default: all enabled)",
+        )
+        parser.add_argument(
+            "--phase",
+            action="append",
+            choices=self.phases,
+            help="Phase to run, can be repeated (default: sites and devices)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Concurrent requests per Cisco DNA Center (overrides concurrency)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Rows per bulk database write (overrides batch_size)",
+        )
+        parser.add_argument(
+            "--deadline",
+            action="store_true",
+            help="Stop phases at the configured deadlines (default: run to completion)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Plan the sync and report changes without writing to NetBox",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Print cProfile and tracemalloc statistics per phase",
+        )
+
+    def handle(self, *args, **options):
+        # Per run overrides of PLUGINS_CONFIG
+        config = dict(settings.PLUGINS_CONFIG)
+        config["netbox_ciscodnac_plugin"] = dict(
+            config.get("netbox_ciscodnac_plugin", {})
+        )
+        if options["workers"] is not None:
+            if options["workers"] < 1:
+                raise CommandError("--workers must be at least 1")
+            config["netbox_ciscodnac_plugin"]["concurrency"] = options["workers"]
+        if options["batch_size"] is not None:
+            if options["batch_size"] < 1:
+                raise CommandError("--batch-size must be at least 1")
+            config["netbox_ciscodnac_plugin"]["batch_size"] = options["batch_size"]
+        if options["deadline"] is False:
+            # Deadlines protect RQ jobs from their timeout, not needed here
+            config["netbox_ciscodnac_plugin"]["deadlines"] = {}
+
+        with override_settings(PLUGINS_CONFIG=config):
+            errors = self.sync(**options)
+
+        if errors:
+            raise CommandError("Sync finished with {} error(s)".format(errors))
+
+    def controller(self, value):
+        """
+        Settings ID of a Cisco DNA Center by ID or hostname
+        """
+        if value.isdigit():
+            tenant = Settings.objects.filter(pk=int(value)).first()
+        else:
+            tenant = Settings.objects.filter(hostname=value).first()
+        if tenant is None:
+            raise CommandError("Cisco DNA Center {} not found".format(value))
+        return tenant.pk
+
+    def sync(self, **options):
+        errors = 0
+        run = str(uuid.uuid4())
+        phases = [p for p in self.phases if p in (options["phase"] or ["sites", "devices"])]
+
+        kwargs = {}
+        if options["controller"]:
+            kwargs["pk"] = self.controller(options["controller"])
+        if options["dry_run"]:
+            kwargs["plan"] = True
+        if options["profile"]:
+            kwargs["profile"] = run
+
+        started = time.monotonic()
+        with Inventory(prefetch=True, **kwargs) as inventory:
+            kwargs["inventory"] = inventory
+
+            # Cisco DNA Centers that failed to authenticate
+            for tenant, status in inventory.dnac_status.items():
+                if status != "success" and status != "disabled":
+                    self.stderr.write("{}: {}".format(tenant, status))
+                    errors += 1
+            if not inventory.dnac:
+                raise CommandError("No Cisco DNA Center available")
+
+            for phase in phases:
+                if phase == "interfaces" and options["dry_run"]:
+                    self.stdout.write("{}: skipped (no dry-run)".format(phase))
+                    continue
+                phase_started = time.monotonic()
+                data = getattr(Data, "sync_{}".format(phase))(**kwargs)
+                duration = time.monotonic() - phase_started
+
+                for tenant, result in data.items():
+                    count, failed = self.count(result)
+                    errors += failed
+                    self.stdout.write(
+                        "{}: {} {} ({} error(s))".format(phase, tenant, count, failed)
+                    )
+                self.stdout.write("{}: {:.2f}s".format(phase, duration))
+
+                if options["dry_run"] is False and phase != "interfaces":
+                    Data.store_results(run=run, object_type=phase[:-1], data=data)
+
+        for tenant in inventory.dnac:
+            self.stdout.write("http: {} {}".format(tenant, CiscoDNAC.http_metrics(tenant)))
+        self.stdout.write("total: {:.2f}s (run {})".format(time.monotonic() - started, run))
+
+        if options["profile"]:
+            reports = System.Profiler.report(run)
+            if reports:
+                self.stdout.write(System.Profiler.text(reports))
+        return errors
+
+    @staticmethod
+    def count(result):
+        """
+        Number of objects and errors of a phase result of a Cisco DNA Center
+        """
+        # Phase failed before any Cisco DNA Center was synced
+        if isinstance(result, str):
+            return 0, int(result.startswith("Error"))
+
+        # Sites and Devices, list of rows
+        if isinstance(result, list):
+            failed = [r for r in result if str(r.get("sync_status", "")).startswith("Error")]
+            return len(result), len(failed)
+
+        # Interfaces, counters of the streamed sync
+        if not all(isinstance(plan, dict) for plan in result.values()):
+            failed = int(str(result.get("sync_status", "")).startswith("Error"))
+            return result, failed
+
+        # Dry-run, plan per object
+        count = {}
+        failed = 0
+        for kind, plan in result.items():
+            count[getattr(kind, "__name__", kind)] = {
+                action: len(plan[action])
+                for action in ["create", "update", "delete"]
+            }
+            failed += len(plan["error"])
+        return count, failed
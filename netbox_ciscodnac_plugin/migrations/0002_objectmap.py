@@ -0,0 +1,57 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("netbox_ciscodnac_plugin", "0001_initial"),
+    ]
+    operations = [
+        migrations.CreateModel(
+            name="ObjectMap",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False
+                    ),
+                ),
+                ("object_type", models.CharField(max_length=50)),
+                ("dnac_id", models.CharField(max_length=100)),
+                ("object_id", models.PositiveBigIntegerField()),
+                ("last_seen", models.DateTimeField()),
+                (
+                    "settings",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="object_maps",
+                        to="netbox_ciscodnac_plugin.settings",
+                    ),
+                ),
+            ],
+            options={
+                "app_label": "netbox_ciscodnac_plugin",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="objectmap",
+            constraint=models.UniqueConstraint(
+                fields=("settings", "object_type", "dnac_id"),
+                name="netbox_ciscodnac_plugin_objectmap_unique_dnac_id",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="objectmap",
+            index=models.Index(
+                fields=["settings", "object_type", "object_id"],
+                name="ciscodnac_objectmap_object",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="objectmap",
+            index=models.Index(
+                fields=["settings", "object_type", "last_seen"],
+                name="ciscodnac_objectmap_seen",
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("netbox_ciscodnac_plugin", "0002_objectmap"),
+    ]
+    operations = [
+        migrations.CreateModel(
+            name="SyncResult",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False
+                    ),
+                ),
+                ("run", models.UUIDField()),
+                ("tenant", models.CharField(max_length=2000)),
+                ("object_type", models.CharField(max_length=50)),
+                (
+                    "object_id",
+                    models.PositiveBigIntegerField(blank=True, null=True),
+                ),
+                ("name", models.CharField(blank=True, max_length=200)),
+                ("slug", models.CharField(blank=True, max_length=100)),
+                ("serial", models.CharField(blank=True, max_length=100)),
+                ("status", models.CharField(blank=True, max_length=50)),
+                ("status_label", models.CharField(blank=True, max_length=20)),
+                ("role", models.CharField(blank=True, max_length=100)),
+                ("device_type", models.CharField(blank=True, max_length=100)),
+                ("site", models.CharField(blank=True, max_length=200)),
+                ("primary_ip4", models.CharField(blank=True, max_length=64)),
+                ("sync_status", models.CharField(max_length=200)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "app_label": "netbox_ciscodnac_plugin",
+                "ordering": ["tenant", "object_type", "name", "pk"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="syncresult",
+            index=models.Index(
+                fields=["run", "tenant", "object_type"],
+                name="ciscodnac_syncresult_run",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="syncresult",
+            index=models.Index(fields=["created"], name="ciscodnac_syncresult_created"),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("netbox_ciscodnac_plugin", "0003_syncresult"),
+    ]
+    operations = [
+        migrations.AddField(
+            model_name="settings",
+            name="page_size",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="settings",
+            name="page_size_min",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="settings",
+            name="page_size_max",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="settings",
+            name="page_time",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
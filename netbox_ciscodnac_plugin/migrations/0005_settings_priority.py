@@ -0,0 +1,14 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("netbox_ciscodnac_plugin", "0004_settings_page_size"),
+    ]
+    operations = [
+        migrations.AddField(
+            model_name="settings",
+            name="priority",
+            field=models.PositiveSmallIntegerField(default=100),
+        ),
+    ]
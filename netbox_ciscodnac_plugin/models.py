@@ -21,6 +21,13 @@ class Settings(ChangeLoggingMixin, models.Model):
     version = models.CharField(max_length=10)
     verify = models.BooleanField(default=False)
     status = models.BooleanField(default=True)
+    # Owner of Devices reported by several Cisco DNA Centers (lowest wins)
+    priority = models.PositiveSmallIntegerField(default=100)
+    # Pagination of Cisco DNA Center APIs (adaptive when empty)
+    page_size = models.PositiveIntegerField(blank=True, null=True)
+    page_size_min = models.PositiveIntegerField(blank=True, null=True)
+    page_size_max = models.PositiveIntegerField(blank=True, null=True)
+    page_time = models.PositiveSmallIntegerField(blank=True, null=True)
     objects = RestrictedQuerySet.as_manager()
 
     class Meta:
@@ -32,3 +39,77 @@ class Settings(ChangeLoggingMixin, models.Model):
 
     def get_absolute_url(self):
         return reverse("plugins:netbox_ciscodnac_plugin:settings")
+
+
+class ObjectMap(models.Model):
+    """
+    Identity map from Cisco DNA Center UUIDs to NetBox objects
+    """
+
+    settings = models.ForeignKey(
+        to=Settings,
+        on_delete=models.CASCADE,
+        related_name="object_maps",
+    )
+    object_type = models.CharField(max_length=50)
+    dnac_id = models.CharField(max_length=100)
+    object_id = models.PositiveBigIntegerField()
+    last_seen = models.DateTimeField()
+
+    class Meta:
+        app_label = "netbox_ciscodnac_plugin"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["settings", "object_type", "dnac_id"],
+                name="netbox_ciscodnac_plugin_objectmap_unique_dnac_id",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["settings", "object_type", "object_id"],
+                name="ciscodnac_objectmap_object",
+            ),
+            models.Index(
+                fields=["settings", "object_type", "last_seen"],
+                name="ciscodnac_objectmap_seen",
+            ),
+        ]
+
+    def __str__(self):
+        return "{} {}".format(self.object_type, self.dnac_id)
+
+
+class SyncResult(models.Model):
+    """
+    Compact outcome of a synced object, per sync run (scalar values only)
+    """
+
+    run = models.UUIDField()
+    tenant = models.CharField(max_length=2000)
+    object_type = models.CharField(max_length=50)
+    object_id = models.PositiveBigIntegerField(blank=True, null=True)
+    name = models.CharField(max_length=200, blank=True)
+    slug = models.CharField(max_length=100, blank=True)
+    serial = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=50, blank=True)
+    status_label = models.CharField(max_length=20, blank=True)
+    role = models.CharField(max_length=100, blank=True)
+    device_type = models.CharField(max_length=100, blank=True)
+    site = models.CharField(max_length=200, blank=True)
+    primary_ip4 = models.CharField(max_length=64, blank=True)
+    sync_status = models.CharField(max_length=200)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        app_label = "netbox_ciscodnac_plugin"
+        ordering = ["tenant", "object_type", "name", "pk"]
+        indexes = [
+            models.Index(
+                fields=["run", "tenant", "object_type"],
+                name="ciscodnac_syncresult_run",
+            ),
+            models.Index(fields=["created"], name="ciscodnac_syncresult_created"),
+        ]
+
+    def __str__(self):
+        return "{} {}".format(self.object_type, self.name)
@@ -1,17 +1,270 @@
-from concurrent.futures import ThreadPoolExecutor
+import time
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import SimpleNamespace
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from django.shortcuts import get_object_or_404
-from dnacentersdk import api
 from ..models import Settings
+from .utilities import System
 from django.core.cache import cache
 import logging
 
 # Assuming logger is set up
 logger = logging.getLogger(__name__)
 
+
+class Breaker:
+    """
+    Circuit breaker per Cisco DNA Center, shared by all processes through Django's cache
+
+    After `breaker_failures` consecutive connection failures, calls to the
+    Cisco DNA Center fail fast during `breaker_cooldown` seconds (degraded).
+    """
+
+    def __init__(self, hostname):
+        self.key = "netbox_ciscodnac_plugin_breaker_{}".format(hostname)
+
+    def state(self):
+        return cache.get(self.key) or {"failures": 0, "open_until": 0}
+
+    def retry_in(self):
+        """
+        Seconds until the Cisco DNA Center is tried again (0 when closed)
+        """
+        return max(int(self.state()["open_until"] - time.time()), 0)
+
+    def success(self):
+        if self.state()["failures"] != 0:
+            cache.delete(self.key)
+
+    def failure(self):
+        state = self.state()
+        state["failures"] += 1
+        cooldown = System.Config.get("breaker_cooldown", 300)
+        if state["failures"] >= System.Config.get("breaker_failures", 3):
+            state["open_until"] = time.time() + cooldown
+        cache.set(self.key, state, timeout=cooldown * 2)
+
+
+class Session(requests.Session):
+    """
+    HTTP Session per Cisco DNA Center with a sized keep-alive connection pool
+
+    Connection setup (TCP/TLS) and total request time are measured, so the
+    transfer time is the difference between both.
+    """
+
+    def __init__(self, concurrency, hostname=None):
+        super().__init__()
+        self.breaker = Breaker(hostname)
+        self.metrics = {
+            "requests": 0,
+            "connections": 0,
+            "connect_time": 0.0,
+            "request_time": 0.0,
+            "bytes": 0,
+        }
+        # Metrics are updated by the threads sharing the Session
+        self.lock = threading.Lock()
+        # Payload size of the last response, per thread
+        self.last = threading.local()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=concurrency,
+            pool_block=True,
+        )
+        adapter.poolmanager.pool_classes_by_scheme = self.pool_classes()
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.headers.update(
+            {
+                "Accept-Encoding": "gzip, deflate",
+                "Connection": "keep-alive",
+            }
+        )
+
+    def pool_classes(self):
+        """
+        urllib3 pools whose connections record the connection setup time
+        """
+        metrics = self.metrics
+        lock = self.lock
+
+        def timed(cls):
+            class TimedConnection(cls):
+                def connect(self):
+                    started = time.monotonic()
+                    super().connect()
+                    with lock:
+                        metrics["connections"] += 1
+                        metrics["connect_time"] += time.monotonic() - started
+
+            return TimedConnection
+
+        class TimedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = timed(HTTPConnection)
+
+        class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = timed(HTTPSConnection)
+
+        return {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+    def call(self, func):
+        """
+        Wrap one logical API call of the SDK (RestSession.request)
+
+        The SDK sends a failed request once more, connection failures are
+        counted once per logical call for the circuit breaker.
+        """
+
+        def wrapper(*args, **kwargs):
+            depth = getattr(self.last, "depth", 0)
+            if depth == 0:
+                self.last.failures = 0
+            self.last.depth = depth + 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.last.depth = depth
+                if depth == 0 and self.last.failures != 0:
+                    self.breaker.failure()
+
+        return wrapper
+
+    def send(self, request, **kwargs):
+        # Fail fast while the Cisco DNA Center is degraded
+        if self.breaker.retry_in() > 0:
+            raise requests.exceptions.ConnectionError(
+                "Circuit open, Cisco DNA Center is degraded", request=request
+            )
+        started = time.monotonic()
+        self.last.bytes = 0
+        try:
+            response = super().send(request, **kwargs)
+            if not kwargs.get("stream"):
+                self.last.bytes = len(response.content)
+                with self.lock:
+                    self.metrics["bytes"] += self.last.bytes
+            self.last.failures = 0
+            self.breaker.success()
+            return response
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if getattr(self.last, "depth", 0) != 0:
+                # Counted when the logical call ends, see `call`
+                self.last.failures = 1
+            else:
+                self.breaker.failure()
+            raise
+        finally:
+            with self.lock:
+                self.metrics["requests"] += 1
+                self.metrics["request_time"] += time.monotonic() - started
+
+
+class TokenStore:
+    """
+    Cisco DNA Center access tokens shared by all processes through Django's cache
+
+    Wraps the SDK `Authentication` object. When the SDK asks for a token again
+    (expired or rejected), only one process re-authenticates while the other
+    processes wait for the new token.
+    """
+
+    def __init__(self, authentication, key):
+        object.__setattr__(self, "authentication", authentication)
+        object.__setattr__(self, "key", key)
+        object.__setattr__(self, "issued", None)
+
+    def __getattr__(self, name):
+        return getattr(self.authentication, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.authentication, name, value)
+
+    def authentication_api(self, **credentials):
+        """
+        Get a valid access token, re-authenticate only when needed
+        """
+        token = cache.get(self.key)
+        # The SDK asks again for the token it has, it is expired or rejected
+        if (
+            token is None
+            or token["token"] == self.issued
+            or token["expires"] <= time.time()
+        ):
+            token = self.refresh(stale=token, **credentials)
+        object.__setattr__(self, "issued", token["token"])
+        return SimpleNamespace(Token=token["token"])
+
+    def refresh(self, stale, **credentials):
+        """
+        Single-flight re-authentication across processes
+        """
+        lock = "{}_lock".format(self.key)
+        if cache.add(lock, True, timeout=30):
+            try:
+                return self.login(**credentials)
+            finally:
+                cache.delete(lock)
+
+        # Another process is re-authenticating, wait for the new token
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            time.sleep(0.2)
+            token = cache.get(self.key)
+            if token is not None and token != stale:
+                return token
+        return self.login(**credentials)
+
+    def login(self, **credentials):
+        ttl = System.Config.get("token_ttl", 3300)
+        token = {
+            "token": self.authentication.authentication_api(**credentials).Token,
+            "expires": time.time() + ttl,
+        }
+        cache.set(self.key, token, timeout=ttl)
+        return token
+
+
+class SharedToken:
+    """
+    DNACenterAPI mixin that gets its access token from the shared TokenStore
+    """
+
+    def __init__(self, token_key, **kwargs):
+        self._token_key = token_key
+        super().__init__(**kwargs)
+
+    @property
+    def authentication(self):
+        return self._authentication
+
+    @authentication.setter
+    def authentication(self, value):
+        self._authentication = TokenStore(value, self._token_key)
+
+
 class CiscoDNAC:
 
-    # Get all tenants from Settings
-    __tenants = Settings.objects.all()
+    # HTTP Sessions per Cisco DNA Center, reused by all API objects in the process
+    sessions = {}
+
+    # DNACenterAPI class, built on first use
+    _api = None
+
+    # Seconds a learned page size is remembered
+    page_ttl = 86400
+
+    # Page size bounds of the Cisco DNA Center APIs
+    page_limits = {
+        "get_device_list": (1, 500),
+        "get_site": (1, 500),
+        "get_all_interfaces": (1, 500),
+    }
 
     def __init__(self, **kwargs):
         """
@@ -34,7 +287,8 @@ class CiscoDNAC:
                 self.dnac[tenant.hostname] = obj[1]
             return
 
-        for tenant in self.__tenants:
+        # Settings are read on each run, not cached at import time
+        for tenant in Settings.objects.all():
             self.dnac_status[tenant.hostname] = "disabled"
 
             # Create Cisco DNA Center API Object if enabled
@@ -44,7 +298,7 @@ class CiscoDNAC:
                 obj = self.auth(tenant)
 
                 # Check that Auth is successful
-                if obj:
+                if obj[0]:
                     self.dnac[tenant.hostname] = obj[1]
         return
 
@@ -52,49 +306,243 @@ class CiscoDNAC:
         """
         Cisco DNA Center API Object
         """
+        # Skip the Cisco DNA Center during the cool-down of its circuit breaker
+        retry_in = Breaker(tenant.hostname).retry_in()
+        if retry_in > 0:
+            self.dnac_status[tenant.hostname] = "degraded (retry in {}s)".format(
+                retry_in
+            )
+            return False, None
         try:
-            obj = api.DNACenterAPI(
+            obj = self.api()(
+                # Token is shared per controller and credentials (password is hashed)
+                token_key="netbox_ciscodnac_plugin_token_{}_{}_{}".format(
+                    tenant.hostname,
+                    tenant.username,
+                    hashlib.sha256(tenant.password.encode()).hexdigest()[0:16],
+                ),
                 username=tenant.username,
                 password=tenant.password,
                 base_url="https://" + tenant.hostname,
                 # version="2.1.2",  # TODO
                 verify=bool(tenant.verify),
+                single_request_timeout=System.Config.get("request_timeout", 30),
+                session=self.session(tenant.hostname),
+            )
+            obj.hostname = tenant.hostname
+            # Circuit breaker counts failures per API call, not per SDK retry
+            obj._session.request = obj._session._req_session.call(
+                obj._session.request
             )
+            obj.paging = {
+                "size": tenant.page_size,
+                "min": tenant.page_size_min,
+                "max": tenant.page_size_max,
+                "time": tenant.page_time,
+            }
             self.dnac_status[tenant.hostname] = "success"
             return True, obj
         except Exception as error_msg:
             print("Error for {}: {}".format(tenant, error_msg))
+            # Login doesn't use the pooled Session, count unreachable here
+            if isinstance(
+                error_msg,
+                (requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+            ):
+                Breaker(tenant.hostname).failure()
             self.dnac_status[tenant.hostname] = error_msg
             return False, None
 
     @classmethod
-    def get_paginated_data(self, tenant, api_call, limit=500, **kwargs):
+    def api(cls):
+        """
+        DNACenterAPI class that shares access tokens between processes
+        """
+        if cls._api is None:
+            # The SDK is imported on first use, it is slow to import
+            from dnacentersdk import api
+
+            cls._api = type("DNACenterAPI", (SharedToken, api.DNACenterAPI), {})
+        return cls._api
+
+    @classmethod
+    def session(cls, hostname):
+        """
+        Get the pooled HTTP Session of a Cisco DNA Center
+        """
+        if hostname not in cls.sessions:
+            cls.sessions[hostname] = Session(
+                concurrency=System.Config.get("concurrency", 4), hostname=hostname
+            )
+        return cls.sessions[hostname]
+
+    @classmethod
+    def http_metrics(cls, hostname):
+        """
+        HTTP metrics of a Cisco DNA Center (connection setup vs transfer time)
+        """
+        if hostname not in cls.sessions:
+            return None
+        session = cls.sessions[hostname]
+        with session.lock:
+            metrics = dict(session.metrics)
+        metrics["transfer_time"] = max(
+            metrics["request_time"] - metrics["connect_time"], 0.0
+        )
+        for key in ["connect_time", "request_time", "transfer_time"]:
+            metrics[key] = round(metrics[key], 2)
+        return metrics
+
+    @classmethod
+    def page_size(cls, tenant, endpoint):
+        """
+        Page size bounds and learned page size of a Cisco DNA Center API
+
+        Returns cache key, minimum, maximum and page size. Overrides of the
+        Settings are part of the cache key, so a change restarts learning.
+        """
+        paging = getattr(tenant, "paging", {})
+        low, high = cls.page_limits.get(endpoint, (1, 500))
+        high = min(high, paging.get("max") or high)
+        low = min(max(low, paging.get("min") or low), high)
+        key = "netbox_ciscodnac_plugin_page_{}_{}_{}_{}_{}".format(
+            getattr(tenant, "hostname", tenant.base_url),
+            endpoint,
+            paging.get("size"),
+            low,
+            high,
+        )
+        size = cache.get(key) or paging.get("size") or high
+        return key, low, high, min(max(size, low), high)
+
+    @staticmethod
+    def adapt(size, low, high, elapsed, payload, target, max_bytes):
+        """
+        Next page size from the latency and payload size of a full page
+        """
+        factor = target / max(elapsed, 0.001)
+        if payload:
+            factor = min(factor, max_bytes / payload)
+        # Keep the page size when close to the target, change at most x2 per page
+        if 0.75 <= factor <= 1.5:
+            return size
+        factor = min(max(factor, 0.5), 2.0)
+        return int(min(max(size * factor, low), high))
+
+    @staticmethod
+    def retryable(error):
+        """
+        Timeouts, connection and server errors are retried with a smaller page
+
+        The SDK re-raises socket errors (e.g. requests' Timeout) as
+        dnacentersdkException, the original error is in its context.
+        """
+        while error is not None:
+            if isinstance(error, (requests.exceptions.RequestException, OSError)):
+                return True
+            if (getattr(error, "status_code", None) or 0) >= 500:
+                return True
+            error = error.__cause__ or error.__context__
+        return False
+
+    @classmethod
+    def get_paginated_data(cls, tenant, api_call, limit=None, **kwargs):
         """
         Generic method to handle paginated API responses from Cisco DNA Center.
         Args:
             tenant: The tenant object containing authentication info.
             api_call: The specific API call to execute (e.g., tenant.devices.get_device_list).
-            limit: Maximum number of results per page (default is 500).
+            limit: Fixed number of results per page (adaptive by default).
             **kwargs: Additional parameters for the API call (like filters).
         Returns:
             A list of all items returned by the paginated API.
         """
         items = []
+        for page in cls.iter_paginated_data(tenant, api_call, limit=limit, **kwargs):
+            items.extend(page)
+        return items
+
+    @classmethod
+    def iter_paginated_data(cls, tenant, api_call, limit=None, **kwargs):
+        """
+        Yield the pages of a paginated API from Cisco DNA Center, one at a time
+
+        The page size adapts to the latency and payload size of each page,
+        within the bounds of the API, and is remembered per Cisco DNA Center
+        and API.
+        """
+        endpoint = getattr(api_call, "__name__", str(api_call))
+        key, low, high, size = cls.page_size(tenant, endpoint)
+        adaptive = limit is None
+        if not adaptive:
+            size = limit
+        target = getattr(tenant, "paging", {}).get("time") or System.Config.get(
+            "page_time", 10
+        )
+        max_bytes = System.Config.get("page_bytes", 4194304)
+        session = cls.sessions.get(getattr(tenant, "hostname", None))
+        stored = size
+
         offset = 1  # Start with the first page
 
         while True:
             # Fetch the current page of results
-            response = api_call(offset=offset, limit=limit, **kwargs).response
-            items.extend(response)
+            started = time.monotonic()
+            try:
+                response = api_call(offset=offset, limit=size, **kwargs).response
+            except Exception as error:
+                # Retry the same page with a smaller page size (unless degraded),
+                # the size is only remembered after a successful page
+                degraded = session is not None and session.breaker.retry_in() > 0
+                if adaptive and size > low and not degraded and cls.retryable(error):
+                    size = max(low, size // 2)
+                    logger.warning(
+                        "%s %s failed (%s), page size reduced to %s",
+                        key,
+                        offset,
+                        error,
+                        size,
+                    )
+                    continue
+                raise
+            elapsed = time.monotonic() - started
+            if adaptive and size != stored:
+                cache.set(key, size, timeout=cls.page_ttl)
+                stored = size
+            System.Progress.page()
+            yield response
 
             # If the number of results is less than the limit, we've retrieved all data
-            if len(response) < limit:
+            if len(response) < size:
                 break
 
-            # Increment the offset for the next page of results
-            offset += limit
+            # Advance by the records received, then size the next page
+            offset += len(response)
+            if adaptive:
+                adapted = cls.adapt(
+                    size,
+                    low,
+                    high,
+                    elapsed,
+                    getattr(session.last, "bytes", 0) if session else 0,
+                    target,
+                    max_bytes,
+                )
+                size = adapted
 
-        return items
+    @staticmethod
+    def device_site(tenant, device):
+        """
+        Get the Site UUID of a single Device from Cisco DNA Center
+        """
+        detail = tenant.devices.get_device_detail(
+            identifier="uuid", search_by=device.id
+        ).response
+        # siteHierarchyGraphId is the path of Site UUIDs, e.g. `/<global>/<area>/<site>/`
+        path = [i for i in (detail.get("siteHierarchyGraphId") or "").split("/") if i]
+        if len(path) == 0:
+            return None
+        return path[-1]
 
     def devices(self, tenant):
         """
@@ -115,21 +563,28 @@ class CiscoDNAC:
         return tenant.sites.get_site_count().response
 
     @classmethod
-    def devices_to_sites(cls, tenant):
+    def devices_to_sites(cls, tenant, sites=None):
         """
         Map Device Serial Number to Site ID from Cisco DNA Center.
         """
         results = {}
         
-        # Fetch sites from DNA Center
-        sites_response = tenant.sites.get_site().response
+        # Fetch sites from DNA Center (unless already fetched)
+        sites_response = sites if sites is not None else tenant.sites.get_site().response
         if not sites_response:
             raise ValueError("No sites found in Cisco DNA Center.")
         
-        for site in sites_response:
-            # Fetch membership for each site
-            membership = tenant.sites.get_membership(site_id=site.id)
-            
+        # Fetch membership for each site concurrently (HTTP pool per controller)
+        with ThreadPoolExecutor(
+            max_workers=System.Config.get("concurrency", 4)
+        ) as executor:
+            memberships = executor.map(
+                lambda site: (site, tenant.sites.get_membership(site_id=site.id)),
+                sites_response,
+            )
+            memberships = list(memberships)
+
+        for site, membership in memberships:
             if not membership or not hasattr(membership, 'device'):
                 # Log if membership is None or doesn't have 'device'
                 print(f"No membership or devices found for site {site.id}")
@@ -153,3 +608,163 @@ class CiscoDNAC:
                         print(f"Device without serial number found in site {site.id}")
         
         return results
+
+    @staticmethod
+    def subtree(sites, site=None, prefix=None):
+        """
+        Split Cisco DNA Center Sites in (root hierarchy, ancestors, subtree)
+
+        The subtree root is a Site UUID or a hierarchy prefix such as
+        `Global/Area/Building`, the subtree is ordered parents first.
+        """
+        root = None
+        if site is not None:
+            for s in sites:
+                if s.id == site:
+                    root = s.siteNameHierarchy
+        elif prefix is not None:
+            root = prefix.strip("/")
+        if not root:
+            return None, [], []
+
+        ancestors, subtree = [], []
+        for s in sites:
+            name = s.siteNameHierarchy
+            if name == root or name.startswith(root + "/"):
+                subtree.append(s)
+            elif root.startswith(name + "/"):
+                ancestors.append(s)
+        subtree.sort(key=lambda s: s.siteNameHierarchy.count("/"))
+        return root, ancestors, subtree
+
+    @staticmethod
+    def devices_by_serial(tenant, serials, chunk_size=100):
+        """
+        Get Devices by Serial Number from Cisco DNA Center
+        """
+        devices = []
+        serials = list(serials)
+        for i in range(0, len(serials), chunk_size):
+            devices += tenant.devices.get_device_list(
+                serial_number=serials[i : i + chunk_size]
+            ).response
+        return devices
+
+
+class Inventory(CiscoDNAC):
+    """
+    Cisco DNA Center collections fetched once per sync run
+
+    Sites, Devices and Site membership are fetched once and shared by all
+    phases of the run. With `prefetch`, Devices and Site membership are
+    fetched in the background while the Sites are synced to NetBox.
+    """
+
+    # Serial number: owning Cisco DNA Center, of the last run
+    owners_key = "netbox_ciscodnac_plugin_owners"
+
+    def __init__(self, prefetch=False, **kwargs):
+        super().__init__(**kwargs)
+        # Single Cisco DNA Center, other instances are known from previous runs
+        self.partial = isinstance(kwargs.get("pk"), int)
+        self._owners = None
+        self.collections = {}
+        self.lock = threading.RLock()
+        self.executor = None
+        if prefetch:
+            self.executor = ThreadPoolExecutor(
+                max_workers=max(len(self.dnac), 1) * 2
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def fetch(self, name, tenant, func, background=False):
+        """
+        Future of a collection of a Cisco DNA Center, fetched once
+        """
+        with self.lock:
+            key = (name, tenant.hostname)
+            if key not in self.collections:
+                if background and self.executor is not None:
+                    self.collections[key] = self.executor.submit(func)
+                else:
+                    future = Future()
+                    try:
+                        future.set_result(func())
+                    except Exception as error:
+                        future.set_exception(error)
+                    self.collections[key] = future
+            return self.collections[key]
+
+    def sites(self, tenant):
+        sites = self.fetch(
+            "sites", tenant, lambda: CiscoDNAC.sites(self, tenant)
+        ).result()
+
+        # Devices and their Sites are fetched meanwhile the Sites are synced,
+        # without prefetch they're fetched on first use
+        if self.executor is not None:
+            self.fetch(
+                "devices",
+                tenant,
+                lambda: CiscoDNAC.devices(self, tenant),
+                background=True,
+            )
+            self.fetch(
+                "site_members",
+                tenant,
+                lambda: self.devices_to_sites(tenant, sites=sites),
+                background=True,
+            )
+        return sites
+
+    def devices(self, tenant):
+        return self.fetch(
+            "devices", tenant, lambda: CiscoDNAC.devices(self, tenant)
+        ).result()
+
+    def owners(self):
+        """
+        Owning Cisco DNA Center of each Device serial number, across all instances
+
+        Lowest priority wins, then hostname. Only the owner writes a Device.
+        """
+        if self._owners is None:
+            priorities = dict(Settings.objects.values_list("hostname", "priority"))
+            claims = {}
+            if self.partial:
+                for serial, owner in (cache.get(self.owners_key) or {}).items():
+                    if owner not in self.dnac:
+                        claims.setdefault(serial, set()).add(owner)
+            for tenant, dnac in self.dnac.items():
+                for device in self.devices(dnac):
+                    if device.deviceSupportLevel == "Supported":
+                        claims.setdefault(device.serialNumber[0:50], set()).add(tenant)
+            self._owners = {
+                serial: min(tenants, key=lambda t: (priorities.get(t, 100), t))
+                for serial, tenants in claims.items()
+            }
+            if not self.partial:
+                cache.set(self.owners_key, self._owners, timeout=86400)
+        return self._owners
+
+    def site_members(self, tenant):
+        """
+        Map Device Serial Number to Site ID, based on the Sites of the run
+        """
+        sites = self.sites(tenant)
+        return self.fetch(
+            "site_members",
+            tenant,
+            lambda: self.devices_to_sites(tenant, sites=sites),
+        ).result()
+
@@ -1,26 +1,44 @@
-from . import CiscoDNAC
+import time
+import uuid
+from datetime import timedelta
+from . import CiscoDNAC, Inventory
 
 # from cacheops import cache, CacheMiss
 from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
 from dcim.models import Site, Device
 from dcim.choices import DeviceStatusChoices
 from tenancy.models import Tenant
-from django_rq import get_queue, job
-from ..models import Settings
+from rq import get_current_job
+from ..models import Settings, SyncResult
 from .netbox import Netbox
 from .utilities import System
+import logging
+
+logger = logging.getLogger(__name__)
 
 
-@job("default")
 def full_sync(**kwargs):
     """
     RQ Background Task for Syncing Cisco DNA Center Instances
     """
     data = {}
+    job = get_current_job()
+    run = job.id if job is not None else str(uuid.uuid4())
+
+    # Profile each phase, the report is stored under the RQ Job ID
+    if kwargs.get("profile"):
+        kwargs["profile"] = run
 
-    # Sync all func from Cisco DNA Center
-    sites = Data.sync_sites(**kwargs)
-    devices = Data.sync_devices(**kwargs)
+    # Sync all func from Cisco DNA Center, collections are fetched once
+    with Inventory(prefetch=True, **kwargs) as inventory:
+        kwargs["inventory"] = inventory
+        sites = Data.sync_sites(**kwargs)
+        devices = Data.sync_devices(**kwargs)
+        interfaces = {}
+        if kwargs.get("interfaces", System.Config.get("interfaces", False)):
+            interfaces = Data.sync_interfaces(**kwargs)
 
     # Count the synced items
     for tenant in sites:
@@ -31,11 +49,54 @@ def full_sync(**kwargs):
         data[tenant]["sites"] = len(sites[tenant])
     for tenant in devices:
         data[tenant]["devices"] = len(devices[tenant])
+    for tenant in interfaces:
+        data[tenant]["interfaces"] = interfaces[tenant]
+
+    # HTTP connection setup vs transfer time per Cisco DNA Center
+    for tenant in data:
+        data[tenant]["http"] = CiscoDNAC.http_metrics(tenant)
+
+    # Store compact results of the run, the job result only holds counters
+    Data.store_results(run=run, object_type="site", data=sites)
+    Data.store_results(run=run, object_type="device", data=devices)
 
     # Return data as results for the job
     return data
 
 
+def event_sync(**kwargs):
+    """
+    RQ Background Task for Syncing a single Device or Site from a Cisco DNA Center event
+    """
+    return Data.sync_event(**kwargs)
+
+
+def subtree_sync(**kwargs):
+    """
+    RQ Background Task for Syncing a site subtree of a Cisco DNA Center
+    """
+    data = {}
+    job = get_current_job()
+    run = job.id if job is not None else str(uuid.uuid4())
+
+    sites, devices = Data.sync_subtree(**kwargs)
+    for tenant in sites:
+        data[tenant] = {"sites": len(sites[tenant])}
+    for tenant in devices:
+        data.setdefault(tenant, {})["devices"] = len(devices[tenant])
+
+    Data.store_results(run=run, object_type="site", data=sites)
+    Data.store_results(run=run, object_type="device", data=devices)
+    return data
+
+
+def tenant_purge(**kwargs):
+    """
+    RQ Background Task for Purging a NetBox Tenant related to Cisco DNA Center
+    """
+    return Netbox.Purge.tenant(**kwargs)
+
+
 class Data:
     def status():
         """
@@ -60,11 +121,14 @@ class Data:
 
         # Get data from Cisco DNA Center
         for tenant, dnac in tenants.dnac.items():
-            data["dnac"][tenant]["sites"] = tenants.sites_count(tenant=dnac)
-            data["dnac"][tenant]["devices"] = 0
-            for device in tenants.devices(tenant=dnac):
-                if device.deviceSupportLevel == "Supported":
-                    data["dnac"][tenant]["devices"] += 1
+            try:
+                data["dnac"][tenant]["sites"] = tenants.sites_count(tenant=dnac)
+                data["dnac"][tenant]["devices"] = 0
+                for device in tenants.devices(tenant=dnac):
+                    if device.deviceSupportLevel == "Supported":
+                        data["dnac"][tenant]["devices"] += 1
+            except Exception as error_msg:
+                data["dnac"][tenant]["api"] = "degraded ({})".format(error_msg)
 
         # Gather data from NetBox
         data["netbox"] = {}
@@ -115,6 +179,7 @@ class Data:
                     for additionalInfo in site.additionalInfo:
                         if "Location" in additionalInfo["nameSpace"]:
                             result = {
+                                "id": site.id,
                                 "name": site.name,
                                 "siteNameHierarchy": site.siteNameHierarchy,
                                 "type": additionalInfo["attributes"]["type"],
@@ -122,6 +187,7 @@ class Data:
                             }
                 else:
                     result = {
+                        "id": site.id,
                         "name": site.name,
                         "siteNameHierarchy": site.siteNameHierarchy,
                         "type": None,
@@ -134,6 +200,50 @@ class Data:
             data[tenant] = results
         return data
 
+    # Columns of the CSV export
+    EXPORT = {
+        "devices": [
+            "id",
+            "hostname",
+            "serialNumber",
+            "managementIpAddress",
+            "platformId",
+            "softwareVersion",
+            "family",
+            "type",
+            "role",
+            "reachabilityStatus",
+            "collectionStatus",
+            "deviceSupportLevel",
+            "upTime",
+            "lastUpdated",
+        ],
+        "sites": [
+            "id",
+            "name",
+            "siteNameHierarchy",
+            "parentId",
+        ],
+    }
+
+    @staticmethod
+    def export(object_type, **kwargs):
+        """
+        Stream Devices or Sites of Cisco DNA Center, record by record
+
+        Yields (tenant, record) while the pages are fetched, memory is
+        bounded by one page.
+        """
+        tenants = CiscoDNAC(**kwargs)
+        for tenant, dnac in tenants.dnac.items():
+            if object_type == "devices":
+                api_call = dnac.devices.get_device_list
+            else:
+                api_call = dnac.sites.get_site
+            for page in tenants.iter_paginated_data(dnac, api_call):
+                for record in page:
+                    yield tenant, record
+
     @classmethod
     def sync_full(cls, **kwargs):
         """
@@ -141,12 +251,12 @@ class Data:
         """
         data = {}
 
-        # Get RQ queue
-        queue = get_queue("default")
+        # Full syncs run on the low priority queue
+        queue = System.RQ.queue("low")
 
         # Get RQ Job ID and display results
         if "id" in kwargs:
-            data = queue.fetch_job(str(kwargs["id"]))
+            data = System.RQ.fetch_job(kwargs["id"])
             if data is None:
                 return None
             return data.result
@@ -155,245 +265,852 @@ class Data:
         job = cache.get("netbox_ciscodnac_plugin_bg")
         if job is None:
             # If not, start full sync task
-            job = full_sync.delay(timeout=900, **kwargs)
+            job = queue.enqueue_call(full_sync, kwargs=kwargs, timeout=900)
             cache.set("netbox_ciscodnac_plugin_bg", job.id, timeout=900)
 
         # Get Job Status
-        j = queue.fetch_job(cache.get("netbox_ciscodnac_plugin_bg"))
+        j = System.RQ.fetch_job(cache.get("netbox_ciscodnac_plugin_bg"))
         job_done = ["finished", "failed"]
         if "finished" == j.get_status():
             # Start again, if cache expired
-            job = full_sync.delay(**kwargs)
+            job = queue.enqueue_call(full_sync, kwargs=kwargs, timeout=900)
             cache.set("netbox_ciscodnac_plugin_bg", job.id, timeout=900)
         if j.get_status() in job_done:
             # Start again, if cache expired
-            job = full_sync.delay(**kwargs)
+            job = queue.enqueue_call(full_sync, kwargs=kwargs, timeout=900)
             cache.set("netbox_ciscodnac_plugin_bg", job.id, timeout=900)
         data["id"] = str(j.id)
         data["task"] = str(j.func_name)
         return data
 
     @classmethod
+    def sync_plan(cls, **kwargs):
+        """
+        Plan Cisco DNA Center Sites and Devices sync (dry-run, no writes)
+        """
+        data = {}
+        started = time.monotonic()
+        kwargs["plan"] = True
+        with Inventory(prefetch=True, **kwargs) as inventory:
+            kwargs["inventory"] = inventory
+            for phase in [cls.sync_sites(**kwargs), cls.sync_devices(**kwargs)]:
+                for tenant, plan in phase.items():
+                    data.setdefault(tenant, {}).update(plan)
+        return {"tenants": data, "duration": round(time.monotonic() - started, 2)}
+
+    @classmethod
+    @System.Profiler.profiled("sites")
     def sync_sites(cls, **kwargs):
         """
         Sync Cisco DNA Center Sites
         """
+        hierarchy = kwargs.get(
+            "hierarchy", System.Config.get("site_hierarchy", False)
+        )
+
+        # Plan the sync in memory without writing to NetBox
+        if kwargs.get("plan"):
+            data = {}
+            tenants = kwargs.get("inventory") or Inventory(**kwargs)
+            for tenant, dnac in tenants.dnac.items():
+                if hierarchy:
+                    data[tenant] = Netbox.Plan.hierarchy(
+                        tenant=tenant, sites=tenants.sites(tenant=dnac)
+                    )
+                else:
+                    data[tenant] = Netbox.Plan.sites(
+                        tenant=tenant, sites=tenants.sites(tenant=dnac)
+                    )
+            return data
 
         # Sync mandatory tag for Cisco DNA Center in NetBox
         dnac_tag = Netbox.Sync.tags(task="system")
+        deadline = System.Deadline.phase("sites", **kwargs)
 
         # Gather all sites in Cisco DNA Center Network Designs
         data = {}
-        tenants = CiscoDNAC(**kwargs)
-        for tenant, dnac in tenants.dnac.items():
-            results = []
-            # Sync Cisco DNA Center Tenant
-            Netbox.Sync.tenants(
-                task="system", tenant=tenant, slug=tenant.replace(".", "-")
-            )
-            # Add tag to Cisco DNA Center Tenant
-            Netbox.Sync.tags(
-                task="update",
-                model="tenant",
-                filter=tenant,
-                tag=dnac_tag,
-            )
-            for site in tenants.sites(tenant=dnac):
-                # Sync Site
-                # Unique name for `Global` as it can't be duplicate in NetBox
-                if site.siteNameHierarchy == "Global":
-                    suffix = site.id.split("-")
-                    site.siteNameHierarchy = "{} {}".format(
-                        site.siteNameHierarchy, suffix[0]
-                    )
-
-                # Use Cisco DNA Center UUID for Site as Slug
-                site.slug = site.id
-                site.sync = Netbox.Sync.site(tenant=tenant, site=site)
-
-                # Add tag to Site
+        tenants = kwargs.get("inventory") or Inventory(**kwargs)
+        # Optionally write one summary changelog entry per changed object
+        changelog = System.Changelog(
+            enabled=kwargs.get(
+                "batch_changelog", System.Config.get("batch_changelog", False)
+            ),
+            batch_size=System.Config.get("batch_size", 500),
+        )
+        with changelog:
+            for tenant, dnac in tenants.dnac.items():
+                results = []
+                if deadline.expired():
+                    data[tenant] = [{"sync_status": "Error: Deadline reached"}]
+                    continue
+                # Sync Cisco DNA Center Tenant
+                Netbox.Sync.tenants(
+                    task="system", tenant=tenant, slug=tenant.replace(".", "-")
+                )
+                # Add tag to Cisco DNA Center Tenant
                 Netbox.Sync.tags(
                     task="update",
-                    model="site",
-                    filter=site.siteNameHierarchy,
+                    model="tenant",
+                    filter=tenant,
                     tag=dnac_tag,
                 )
+                System.Progress.phase("sites", tenant=tenant)
+                sites = tenants.sites(tenant=dnac)
+                System.Progress.total(len(sites))
 
-                site.status = "Active"
-                site.status_label = "success"
-                result = {
-                    "name": site.name,
-                    "status": site.status,
-                    "status_label": site.status_label,
-                    "slug": site.slug,
-                    "sync_status": site.sync[1],
-                }
-                results.append(result)
+                # Sync site tree as Regions (areas), Sites (buildings) and Locations (floors)
+                if hierarchy:
+                    results = Netbox.Hierarchy.sync(
+                        tenant=tenant,
+                        sites=sites,
+                        tag=dnac_tag,
+                        batch_size=System.Config.get("batch_size", 500),
+                    )
+                    System.Progress.step(len(sites))
+                    Netbox.Purge.database(
+                        tenant=tenant,
+                        type="sites",
+                        data=[r for r in results if r["type"] == "building"],
+                    )
+                    results = sorted(results, key=lambda k: k["name"], reverse=False)
+                    data[tenant] = results
+                    continue
 
-            # If site is removed in Cisco DNA Center, then remove in NetBox
-            Netbox.Purge.database(tenant=tenant, type="sites", data=results)
-            results = sorted(results, key=lambda k: k["name"], reverse=False)
-            data[tenant] = results
+                # Resolve existing Sites with the identity map
+                site_map = Netbox.Map.resolve(tenant=tenant, type="site")
+                seen = {}
+                started = timezone.now()
+                for site in sites:
+                    # Stop cleanly when the time budget is spent
+                    if deadline.expired():
+                        break
+
+                    # Sync Site
+                    # Unique name for `Global` as it can't be duplicate in NetBox
+                    if site.siteNameHierarchy == "Global":
+                        suffix = site.id.split("-")
+                        site.siteNameHierarchy = "{} {}".format(
+                            site.siteNameHierarchy, suffix[0]
+                        )
+
+                    # Use Cisco DNA Center UUID for Site as Slug
+                    site.slug = site.id
+                    site.sync = Netbox.Sync.site(
+                        tenant=tenant, site=site, pk=site_map.get(site.id)
+                    )
+                    seen[site.id] = site.sync[0].pk
+
+                    # Add tag to Site
+                    Netbox.Sync.tags(
+                        task="update",
+                        model="site",
+                        filter=site.siteNameHierarchy,
+                        tag=dnac_tag,
+                    )
+
+                    site.status = "Active"
+                    site.status_label = "success"
+                    result = {
+                        "id": site.sync[0].pk,
+                        "name": site.name,
+                        "status": site.status,
+                        "status_label": site.status_label,
+                        "slug": site.slug,
+                        "sync_status": site.sync[1],
+                    }
+                    results.append(result)
+                    System.Progress.step()
+
+                # Update identity map for Sites
+                Netbox.Map.record(tenant=tenant, type="site", mapping=seen)
+                if deadline.expired():
+                    # Incomplete, nothing is purged
+                    System.Progress.step(count=0, error=True)
+                    results.append({"name": "", "sync_status": "Error: Deadline reached"})
+                    data[tenant] = results
+                    continue
+                Netbox.Map.prune(tenant=tenant, type="site", before=started)
+
+                # If site is removed in Cisco DNA Center, then remove in NetBox
+                Netbox.Purge.database(tenant=tenant, type="sites", data=results)
+                results = sorted(results, key=lambda k: k["name"], reverse=False)
+                data[tenant] = results
         return data
 
     @classmethod
+    @System.Profiler.profiled("devices")
     def sync_devices(cls, **kwargs):
         """
         Sync Cisco DNA Center Devices
         """
 
+        # Plan the sync in memory without writing to NetBox
+        if kwargs.get("plan"):
+            data = {}
+            tenants = kwargs.get("inventory") or Inventory(**kwargs)
+            for tenant, dnac in tenants.dnac.items():
+                data[tenant] = Netbox.Plan.devices(
+                    tenant=tenant,
+                    devices=tenants.devices(tenant=dnac),
+                    site_members=tenants.site_members(tenant=dnac),
+                    owners=tenants.owners(),
+                )
+            return data
+
         # Sync mandatory tag for Cisco DNA Center
         dnac_tag = Netbox.Sync.tags(task="system")
+        deadline = System.Deadline.phase("devices", **kwargs)
 
         # Gather all devices in Cisco DNA Center Inventory
         data = {}
-        tenants = CiscoDNAC(**kwargs)
+        tenants = kwargs.get("inventory") or Inventory(**kwargs)
+        # Optionally write one summary changelog entry per changed object
+        changelog = System.Changelog(
+            enabled=kwargs.get(
+                "batch_changelog", System.Config.get("batch_changelog", False)
+            ),
+            batch_size=System.Config.get("batch_size", 500),
+        )
+        with changelog:
+            for tenant, dnac in tenants.dnac.items():
+                results = []
+
+                System.Progress.phase("devices", tenant=tenant)
+                if deadline.expired():
+                    data[tenant] = [{"sync_status": "Error: Deadline reached"}]
+                    continue
+
+                # NetBox sites mandatory to assign sites
+                if System.Check.sites(tenant=tenant) is False:
+                    System.Progress.step(error=True)
+                    data[tenant] = [{"sync_status": "Error: Sync sites first"}]
+                    continue
+            
+                # Map Devices (Serial) against Site UUID
+                site_members = tenants.site_members(tenant=dnac)
+                # Ensure site_members is not None before proceeding
+                if site_members is None:
+                    data[tenant] = [{"sync_status": "Error: No site members found"}]
+                    continue
+
+                # Ensure tenants exist before looping
+                if not tenants or not tenants.dnac:
+                    data["sync_status"] = "Error: No tenants found"
+                    return data
+            
+                # Sync devices from Cisco DNA Center
+                started = timezone.now()
+                owners = tenants.owners()
+                results = cls.upsert_devices(
+                    tenant=tenant,
+                    devices=tenants.devices(tenant=dnac),
+                    site_members=site_members,
+                    tag=dnac_tag,
+                    owners=owners,
+                    deadline=deadline,
+                )
+                if deadline.expired():
+                    # Incomplete, nothing is purged
+                    System.Progress.step(count=0, error=True)
+                    results.append({"name": "", "sync_status": "Error: Deadline reached"})
+                    data[tenant] = results
+                    continue
+                Netbox.Map.prune(tenant=tenant, type="device", before=started)
+
+                # If device is removed in Cisco DNA Center, then remove in NetBox
+                # (unless another Cisco DNA Center still reports it)
+                Netbox.Purge.database(
+                    tenant=tenant, type="devices", data=results, keep=owners
+                )
+
+                results = sorted(results, key=lambda k: k["name"], reverse=False)
+                data[tenant] = results
+        return data
+
+    @classmethod
+    @System.Profiler.profiled("interfaces")
+    def sync_interfaces(cls, **kwargs):
+        """
+        Sync Cisco DNA Center Interfaces (streamed page by page)
+        """
+
+        # Sync mandatory tag for Cisco DNA Center
+        dnac_tag = Netbox.Sync.tags(task="system")
+        deadline = System.Deadline.phase("interfaces", **kwargs)
+
+        data = {}
+        tenants = kwargs.get("inventory") or Inventory(**kwargs)
         for tenant, dnac in tenants.dnac.items():
-            results = []
+            System.Progress.phase("interfaces", tenant=tenant)
+            if deadline.expired():
+                data[tenant] = {"sync_status": "Error: Deadline reached"}
+                continue
 
-            # NetBox sites mandatory to assign sites
-            if System.Check.sites(tenant=tenant) is False:
-                data[tenant] = [{"sync_status": "Error: Sync sites first"}]
+            # Interfaces are assigned to synced Devices only
+            if System.Check.devices(tenant=tenant) is False:
+                System.Progress.step(error=True)
+                data[tenant] = {"sync_status": "Error: Sync devices first"}
                 continue
-            
-            # Map Devices (Serial) against Site UUID
-            site_members = CiscoDNAC.devices_to_sites(tenant=dnac)
-            # Ensure site_members is not None before proceeding
-            if site_members is None:
-                data[tenant] = [{"sync_status": "Error: No site members found"}]
+
+            data[tenant] = Netbox.Interfaces.sync(
+                tenant=tenant,
+                pages=tenants.iter_paginated_data(
+                    dnac, dnac.devices.get_all_interfaces
+                ),
+                tag=dnac_tag,
+                batch_size=System.Config.get("batch_size", 500),
+                deadline=deadline,
+            )
+        return data
+
+    @classmethod
+    def upsert_devices(
+        cls, tenant, devices, site_members, tag, owners=None, deadline=None,
+        partial=False,
+    ):
+        """
+        Sync Cisco DNA Center Devices of one Tenant (Serial: Site UUID mapping)
+
+        Devices owned by another Cisco DNA Center (`owners`, Serial: hostname)
+        are skipped. With `partial` (e.g. an event), NetBox state is only
+        loaded for these Devices instead of the whole Tenant.
+        """
+        results = []
+        owners = owners or {}
+
+        # Sync Cisco DNA Center Tenant
+        Netbox.Sync.tenants(task="system", tenant=tenant, slug=tenant.replace(".", "-"))
+        Netbox.Sync.tags(
+            task="update",
+            model="tenant",
+            filter=tenant,
+            tag=tag,
+        )
+
+        # Owner of each management IP, Devices can share IPs in Cisco DNA Center
+        supported = [
+            d
+            for d in devices
+            if d.deviceSupportLevel == "Supported"
+            and owners.get(d.serialNumber[0:50], tenant) == tenant
+        ]
+        ip_owners, conflicts = Netbox.Sync.conflicts(tenant=tenant, devices=supported)
+        for host, serials in conflicts.items():
+            logger.warning(
+                "%s: %s is shared by %s, assigned to %s",
+                tenant,
+                host,
+                ", ".join([ip_owners[host]] + serials),
+                ip_owners[host],
+            )
+
+        # Sync IP Addresses of supported devices in bulk
+        ipaddresses = Netbox.Sync.ipaddresses(
+            tenant=tenant,
+            devices=[
+                d
+                for d in supported
+                if ip_owners.get(System.Address.host(d.managementIpAddress))
+                == d.serialNumber[0:50]
+            ],
+            partial=partial,
+        )
+        primary_ips = {}
+        device_ips = []
+
+        # Index of Cisco DNA Center site UUID to NetBox Site and Location
+        site_index = Netbox.Hierarchy.index(
+            tenant=tenant,
+            slugs=[site_members.get(d.serialNumber) for d in devices] if partial else None,
+        )
+
+        # Resolve existing Devices with the identity map
+        if partial:
+            device_map = Netbox.Map.lookup(
+                tenant=tenant, type="device", dnac_ids=[d.id for d in devices]
+            )
+        else:
+            device_map = Netbox.Map.resolve(tenant=tenant, type="device")
+        seen = {}
+        attributes = {}
+
+        System.Progress.total(len(devices))
+        for device in devices:
+            # Stop cleanly when the time budget is spent, written Devices are kept
+            if deadline is not None and deadline.expired():
+                break
+            System.Progress.step()
+
+            # Device is written by the owning Cisco DNA Center only
+            owner = owners.get(device.serialNumber[0:50], tenant)
+            if device.deviceSupportLevel == "Supported" and owner != tenant:
+                results.append(
+                    {
+                        "name": device.hostname,
+                        "serial": device.serialNumber[0:50],
+                        "status": "Skipped",
+                        "status_label": "default",
+                        "sync_status": "Skipped: owned by {}".format(owner),
+                    }
+                )
                 continue
 
-            # Ensure tenants exist before looping
-            if not tenants or not tenants.dnac:
-                data["sync_status"] = "Error: No tenants found"
-                return data
-            
-            # Get devices from Cisco DNA Center
-            for device in tenants.devices(tenant=dnac):
+            # Check that the device is supported in Cisco DNA Center
+            if device.deviceSupportLevel == "Supported":
 
-                # Sync Cisco DNA Center Tenant
-                Netbox.Sync.tenants(
-                    task="system", tenant=tenant, slug=tenant.replace(".", "-")
+                # Sync Manufacture
+                device.manufacture = device.type.split()[0]
+                device.manufacture = Netbox.Sync.manufacturer(
+                    manufacture=device.manufacture, tenant=tenant
+                )
+
+                # Sync Device Types
+                slug = System.Slug.create(device.family)
+                device.family_type = Netbox.Sync.devicetype(
+                    manufacture=device.manufacture,
+                    model=device.family,
+                    slug=slug,
+                    tenant=tenant,
                 )
+                # Add tag to devicetype
                 Netbox.Sync.tags(
                     task="update",
-                    model="tenant",
-                    filter=tenant,
-                    tag=dnac_tag,
+                    model="devicetype",
+                    filter=slug,
+                    tag=tag,
                 )
 
-                # Check that the device is supported in Cisco DNA Center
-                if device.deviceSupportLevel == "Supported":
+                # Sync Device Roles
+                slug = System.Slug.create(device.role)
+                device.role = Netbox.Sync.devicerole(
+                    role=device.role, slug=slug, tenant=tenant
+                )
 
-                    # Sync Manufacture
-                    device.manufacture = device.type.split()[0]
-                    device.manufacture = Netbox.Sync.manufacturer(
-                        manufacture=device.manufacture, tenant=tenant
+                # Device IP Address (synced in bulk), only for the owner of the IP
+                host = System.Address.host(device.managementIpAddress)
+                device.primary_ip4 = None
+                if ip_owners.get(host) == device.serialNumber[0:50]:
+                    device.primary_ip4 = ipaddresses.get(host)
+                # Device Site and Location (floor)
+                placement = site_index.get(site_members.get(device.serialNumber))
+                if placement is None:
+                    System.Progress.step(count=0, error=True)
+                    results.append(
+                        {
+                            "name": device.hostname,
+                            "serial": device.serialNumber,
+                            "sync_status": "Error: Site not found",
+                        }
                     )
+                    continue
+                device.site, device.floor = placement
 
-                    # Sync Device Types
-                    slug = System.Slug.create(device.family)
-                    device.family_type = Netbox.Sync.devicetype(
-                        manufacture=device.manufacture,
-                        model=device.family,
-                        slug=slug,
-                        tenant=tenant,
-                    )
-                    # Add tag to devicetype
-                    Netbox.Sync.tags(
-                        task="update",
-                        model="devicetype",
-                        filter=slug,
-                        tag=dnac_tag,
+                # Check if devices is reachable from Cisco DNA Center
+                if device.reachabilityStatus == "Reachable":
+                    device.status = DeviceStatusChoices.STATUS_ACTIVE
+                    device.status_label = "success"
+                else:
+                    device.status = DeviceStatusChoices.STATUS_FAILED
+                    device.status_label = "danger"
+
+                # Sync Device and get status
+                sync_status = Netbox.Sync.device(
+                    tenant=tenant, device=device, pk=device_map.get(device.id)
+                )
+                seen[device.id] = sync_status[0].pk
+                attributes[sync_status[0].pk] = device
+                if device.serialNumber in conflicts.get(host, []):
+                    # The IP is owned by another Device
+                    System.Progress.step(count=0, error=True)
+                    sync_status = (
+                        sync_status[0],
+                        "Error: Duplicate IP {} (owned by {})".format(
+                            host, ip_owners[host]
+                        ),
                     )
+                if device.primary_ip4 is not None:
+                    device_ips.append(device.primary_ip4)
+                    primary_ips[sync_status[0].pk] = device.primary_ip4
+                # Add tag to device
+                Netbox.Sync.tags(
+                    task="update",
+                    model="device",
+                    filter=device.serialNumber,
+                    tag=tag,
+                )
+                # Scalar values only, results are stored and pickled by RQ
+                result = {
+                    "id": sync_status[0].pk,
+                    "name": device.hostname,
+                    "status": device.status,
+                    "status_label": device.status_label,
+                    "role": str(device.role),
+                    "device_type": str(device.family_type),
+                    "site": str(device.site),
+                    "primary_ip4": str(device.primary_ip4 or ""),
+                    "serial": device.serialNumber,
+                    "sync_status": sync_status[1],
+                }
+                results.append(result)
+
+        # Assign primary IPs and tag IP Addresses in bulk
+        Netbox.Sync.primary_ips(primary_ips)
+
+        # Cisco DNA Center attributes (e.g. softwareVersion) to custom fields in bulk
+        Netbox.Sync.attributes(
+            devices=attributes,
+            mapping=System.Config.get("custom_fields", {}) or {},
+            batch_size=System.Config.get("batch_size", 500),
+        )
+        Netbox.Sync.tags(task="bulk", objects=device_ips, tag=tag)
 
-                    # Sync Device Roles
-                    slug = System.Slug.create(device.role)
-                    device.role = Netbox.Sync.devicerole(
-                        role=device.role, slug=slug, tenant=tenant
+        # Update identity map for Devices
+        Netbox.Map.record(tenant=tenant, type="device", mapping=seen)
+        return results
+
+    @classmethod
+    def sync_event(cls, **kwargs):
+        """
+        Sync a single Device or Site of a Cisco DNA Center Instance
+        """
+
+        # Sync mandatory tag for Cisco DNA Center
+        dnac_tag = Netbox.Sync.tags(task="system")
+
+        data = {}
+        tenants = CiscoDNAC(pk=kwargs["pk"])
+        for tenant, dnac in tenants.dnac.items():
+            data[tenant] = []
+
+            # Refresh the Device reported by the event
+            if kwargs.get("device") or kwargs.get("address"):
+                if kwargs.get("device"):
+                    devices = dnac.devices.get_device_list(id=kwargs["device"]).response
+                else:
+                    devices = dnac.devices.get_device_list(
+                        management_ip_address=kwargs["address"]
+                    ).response
+                site_members = {}
+                for device in devices:
+                    site_members[device.serialNumber] = CiscoDNAC.device_site(
+                        tenant=dnac, device=device
                     )
+                    if site_members[device.serialNumber] is None:
+                        # Keep the current placement of the Device in NetBox
+                        current = (
+                            Device.objects.filter(serial=device.serialNumber)
+                            .values_list("location__slug", "site__slug")
+                            .first()
+                        )
+                        if current is not None:
+                            site_members[device.serialNumber] = current[0] or current[1]
+                data[tenant] += cls.upsert_devices(
+                    tenant=tenant,
+                    devices=devices,
+                    site_members=site_members,
+                    tag=dnac_tag,
+                    owners=cache.get(Inventory.owners_key),
+                    partial=True,
+                )
 
-                    # Sync Device IP Address
-                    device.primary_ip4 = Netbox.Sync.ipaddress(
+            # Refresh the Site reported by the event
+            elif kwargs.get("site"):
+                if kwargs.get("hierarchy", System.Config.get("site_hierarchy", False)):
+                    # Parents are needed for the tree, sync all sites without devices
+                    data[tenant] += Netbox.Hierarchy.sync(
                         tenant=tenant,
-                        address=device.managementIpAddress,
-                        hostname=device.hostname,
-                    )
-                    # Add tags to IP Address
-                    Netbox.Sync.tags(
-                        task="update",
-                        model="ipaddress",
-                        filter=device.primary_ip4,
+                        sites=tenants.sites(tenant=dnac),
                         tag=dnac_tag,
-                        tenant=tenant,
+                        batch_size=System.Config.get("batch_size", 500),
+                        # Removals are left to the full sync
+                        purge=False,
                     )
-                    # Device Site Location
-                    device.site = Site.objects.get(
-                        slug=site_members[device.serialNumber],
-                        tenant=Tenant.objects.get(name=tenant).id,
+                    continue
+                site_map = Netbox.Map.lookup(
+                    tenant=tenant, type="site", dnac_ids=[kwargs["site"]]
+                )
+                for site in dnac.sites.get_site(site_id=kwargs["site"]).response:
+                    if site.siteNameHierarchy == "Global":
+                        continue
+                    site.slug = site.id
+                    site.sync = Netbox.Sync.site(
+                        tenant=tenant, site=site, pk=site_map.get(site.id)
                     )
+                    Netbox.Sync.tags(task="bulk", objects=[site.sync[0]], tag=dnac_tag)
+                    Netbox.Map.record(
+                        tenant=tenant, type="site", mapping={site.id: site.sync[0].pk}
+                    )
+                    data[tenant].append(
+                        {
+                            "name": site.name,
+                            "status": "Active",
+                            "status_label": "success",
+                            "slug": site.slug,
+                            "sync_status": site.sync[1],
+                        }
+                    )
+        return data
 
-                    # Check if devices is reachable from Cisco DNA Center
-                    if device.reachabilityStatus == "Reachable":
-                        device.status = DeviceStatusChoices.STATUS_ACTIVE
-                        device.status_label = "success"
-                    else:
-                        device.status = DeviceStatusChoices.STATUS_FAILED
-                        device.status_label = "danger"
-
-                    # Sync Device and get status
-                    sync_status = Netbox.Sync.device(tenant=tenant, device=device)
-                    # Add tag to device
-                    Netbox.Sync.tags(
-                        task="update",
-                        model="device",
-                        filter=device.serialNumber,
-                        tag=dnac_tag,
+    @classmethod
+    def sync_subtree(cls, **kwargs):
+        """
+        Sync the Sites and Devices of a site subtree of a Cisco DNA Center
+
+        The subtree is a Site UUID (`site`) or hierarchy prefix (`prefix`).
+        Membership is fetched for the subtree only and the purge is limited
+        to Sites and Devices placed in the subtree.
+        """
+        hierarchy = kwargs.get(
+            "hierarchy", System.Config.get("site_hierarchy", False)
+        )
+
+        # Sync mandatory tag for Cisco DNA Center
+        dnac_tag = Netbox.Sync.tags(task="system")
+        deadline = System.Deadline.phase("devices", **kwargs)
+
+        sites_data = {}
+        devices_data = {}
+        tenants = CiscoDNAC(pk=kwargs["pk"])
+        for tenant, dnac in tenants.dnac.items():
+            System.Progress.phase("subtree", tenant=tenant)
+
+            # NetBox sites mandatory to assign sites
+            if System.Check.sites(tenant=tenant) is False:
+                sites_data[tenant] = [{"sync_status": "Error: Sync sites first"}]
+                continue
+
+            root, ancestors, subtree = CiscoDNAC.subtree(
+                tenants.sites(tenant=dnac),
+                site=kwargs.get("site"),
+                prefix=kwargs.get("prefix"),
+            )
+            if len(subtree) == 0:
+                sites_data[tenant] = [{"sync_status": "Error: Site not found"}]
+                continue
+            System.Progress.total(len(subtree))
+
+            # Sync the Sites of the subtree (with its parents for the tree)
+            if hierarchy:
+                results = Netbox.Hierarchy.sync(
+                    tenant=tenant,
+                    sites=ancestors + subtree,
+                    tag=dnac_tag,
+                    batch_size=System.Config.get("batch_size", 500),
+                    purge=False,
+                )
+                ids = {site.id for site in subtree}
+                results = [r for r in results if r.get("slug") in ids]
+            else:
+                results = []
+                seen = {}
+                site_map = Netbox.Map.resolve(tenant=tenant, type="site")
+                for site in subtree:
+                    if site.siteNameHierarchy == "Global":
+                        continue
+                    site.slug = site.id
+                    site.sync = Netbox.Sync.site(
+                        tenant=tenant, site=site, pk=site_map.get(site.id)
                     )
-                    result = {
-                        "name": device.hostname,
-                        "status": device.status,
-                        "status_label": device.status_label,
-                        "role": device.role,
-                        "type": device.family_type,
-                        "site": device.site,
-                        "primary_ip4": device.primary_ip4,
-                        "serial": device.serialNumber,
-                        "sync_status": sync_status[1],
-                    }
-                    results.append(result)
+                    seen[site.id] = site.sync[0].pk
+                    Netbox.Sync.tags(task="bulk", objects=[site.sync[0]], tag=dnac_tag)
+                    results.append(
+                        {
+                            "id": site.sync[0].pk,
+                            "name": site.name,
+                            "status": "Active",
+                            "status_label": "success",
+                            "slug": site.slug,
+                            "sync_status": site.sync[1],
+                        }
+                    )
+                Netbox.Map.record(tenant=tenant, type="site", mapping=seen)
+            sites_data[tenant] = results
 
-            # If device is removed in Cisco DNA Center, then remove in NetBox
-            Netbox.Purge.database(tenant=tenant, type="devices", data=results)
+            # Map Devices (Serial) against Site UUID, deepest Site wins
+            site_members = tenants.devices_to_sites(tenant=dnac, sites=subtree)
 
-            results = sorted(results, key=lambda k: k["name"], reverse=False)
-            data[tenant] = results
-        return data
+            # Sync the Devices of the subtree only
+            owners = cache.get(Inventory.owners_key)
+            results = cls.upsert_devices(
+                tenant=tenant,
+                devices=CiscoDNAC.devices_by_serial(dnac, site_members),
+                site_members=site_members,
+                tag=dnac_tag,
+                owners=owners,
+                deadline=deadline,
+            )
+            if deadline.expired():
+                # Incomplete, nothing is purged
+                System.Progress.step(count=0, error=True)
+                results.append({"name": "", "sync_status": "Error: Deadline reached"})
+                devices_data[tenant] = results
+                continue
 
-    def purge_tenant(**kwargs):
+            # Purge limited to the subtree, including Sites removed from it
+            slugs = [site.id for site in subtree]
+            if not hierarchy:
+                slugs += Site.objects.filter(
+                    Q(name=root[0:100]) | Q(name__startswith=root + "/"),
+                    tenant__name=tenant,
+                ).values_list("slug", flat=True)
+            Netbox.Purge.database(
+                tenant=tenant,
+                type="devices",
+                data=results,
+                # Devices owned by other Cisco DNA Centers only
+                keep=[s for s, owner in (owners or {}).items() if owner != tenant],
+                scope=Q(location__slug__in=slugs)
+                | Q(location__isnull=True, site__slug__in=slugs),
+            )
+            if not hierarchy:
+                Netbox.Purge.database(
+                    tenant=tenant,
+                    type="sites",
+                    data=sites_data[tenant],
+                    scope=Q(slug__in=slugs),
+                )
+            devices_data[tenant] = sorted(results, key=lambda k: k["name"])
+        return sites_data, devices_data
+
+    @staticmethod
+    def store_results(run, object_type, data):
         """
-        Remove NetBox Tenant that is related to Cisco DNA Center
+        Store sync results as compact rows, per run (RQ Job ID or UUID)
         """
-        results = Netbox.Purge.tenant(**kwargs)
-        return results
+        rows = []
+        for tenant, results in data.items():
+            if not isinstance(results, list):
+                continue
+            for result in results:
+                rows.append(
+                    SyncResult(
+                        run=run,
+                        tenant=tenant,
+                        # Site hierarchy results have their own type (area, building, floor)
+                        object_type=result.get("type") or object_type,
+                        object_id=result.get("id"),
+                        name=(result.get("name") or "")[0:200],
+                        slug=(result.get("slug") or "")[0:100],
+                        serial=result.get("serial") or "",
+                        status=result.get("status") or "",
+                        status_label=result.get("status_label") or "",
+                        role=result.get("role") or "",
+                        device_type=result.get("device_type") or "",
+                        site=result.get("site") or "",
+                        primary_ip4=result.get("primary_ip4") or "",
+                        sync_status=str(result.get("sync_status"))[0:200],
+                    )
+                )
+        SyncResult.objects.bulk_create(
+            rows, batch_size=System.Config.get("batch_size", 500)
+        )
+
+        # Remove results of older runs
+        SyncResult.objects.filter(
+            created__lt=timezone.now()
+            - timedelta(days=System.Config.get("result_retention", 7))
+        ).delete()
+        return len(rows)
 
     @staticmethod
-    def job_status(id):
+    def results(**kwargs):
         """
-        Get RQ Job Status
+        Filter stored sync results, e.g. only errors of a run
         """
+        results = SyncResult.objects.all()
+        if kwargs.get("run"):
+            try:
+                results = results.filter(run=uuid.UUID(str(kwargs["run"])))
+            except ValueError:
+                return results.none()
+        if kwargs.get("tenant"):
+            results = results.filter(tenant=kwargs["tenant"])
+        if kwargs.get("object_type"):
+            results = results.filter(object_type=kwargs["object_type"])
+        if kwargs.get("sync_status"):
+            results = results.filter(sync_status__istartswith=kwargs["sync_status"])
+        if kwargs.get("q"):
+            results = results.filter(
+                Q(name__icontains=kwargs["q"])
+                | Q(serial__icontains=kwargs["q"])
+                | Q(primary_ip4__startswith=kwargs["q"])
+            )
+        return results
 
-        # Get RQ queue
+    def purge_tenant(**kwargs):
+        """
+        Remove NetBox Tenant that is related to Cisco DNA Center as RQ job
+        """
         data = {}
-        queue = get_queue("default")
-        # Get Job Id data
-        j = queue.fetch_job(str(id))
-        if j is None:
-            # No job exists with that `id`
-            return None
-        data["id"] = str(id)
+
+        # Follow the ongoing purge of the Tenant, or start (resume) it
+        key = "netbox_ciscodnac_plugin_purge_job_{}".format(kwargs["pk"])
+        j = System.RQ.fetch_job(cache.get(key)) if cache.get(key) else None
+        if j is None or j.get_status() in ["finished", "failed", "stopped", "canceled"]:
+            j = System.RQ.queue("low").enqueue_call(
+                tenant_purge, kwargs={"pk": kwargs["pk"]}, timeout=3600
+            )
+            cache.set(key, j.id, timeout=3600)
+        data["id"] = str(j.id)
         data["task"] = str(j.func_name)
-        data["status"] = str(j.get_status())
-        data["result"] = str(j.result)
-        data["exception"] = str(j.exc_info)
         return data
+
+    @staticmethod
+    def enqueue_subtree(**kwargs):
+        """
+        Sync a site subtree of a Cisco DNA Center as RQ job
+        """
+        data = {}
+        j = System.RQ.queue("high").enqueue_call(
+            subtree_sync,
+            kwargs={
+                "pk": kwargs["pk"],
+                "site": kwargs.get("site"),
+                "prefix": kwargs.get("prefix"),
+            },
+            timeout=900,
+        )
+        data["id"] = str(j.id)
+        data["task"] = str(j.func_name)
+        return data
+
+    @staticmethod
+    def job_result(id):
+        """
+        Get RQ Job result
+        """
+        j = System.RQ.fetch_job(id)
+        if j is None:
+            return None
+        return j.result
+
+    @staticmethod
+    def job_status(id, wait=0, since=None):
+        """
+        Get RQ Job Status and progress (compact, without the job result)
+
+        With `wait`, long-poll up to `wait` seconds until the status or the
+        progress differs from `since` (the `updated` timestamp the client has).
+        """
+
+        deadline = time.monotonic() + min(float(wait), 30)
+        while True:
+            # Get Job Id data (from any of the plugin queues)
+            j = System.RQ.fetch_job(id)
+            if j is None:
+                # No job exists with that `id`
+                return None
+            data = {}
+            data["id"] = str(id)
+            data["task"] = str(j.func_name)
+            data["status"] = str(j.get_status())
+            data["progress"] = j.meta.get("progress")
+            data["exception"] = str(j.exc_info) if data["status"] == "failed" else None
+            updated = (data["progress"] or {}).get("updated")
+            if (
+                data["status"] in ["finished", "failed", "stopped", "canceled"]
+                or str(updated) != str(since)
+                or time.monotonic() >= deadline
+            ):
+                return data
+            time.sleep(0.5)
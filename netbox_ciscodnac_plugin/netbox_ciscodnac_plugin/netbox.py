@@ -1,11 +1,30 @@
 from decimal import Decimal
 import ipaddress
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import ProtectedError
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404
-from extras.models import Tag
-from dcim.models import Site, Device, DeviceRole, DeviceType, Manufacturer
+from django.utils import timezone
+from django.contrib.contenttypes.models import ContentType
+from core.models import ObjectType
+from extras.choices import CustomFieldTypeChoices
+from extras.models import CustomField, Tag, TaggedItem
+from dcim.models import (
+    Site,
+    Device,
+    DeviceRole,
+    DeviceType,
+    Interface,
+    Location,
+    Manufacturer,
+    Region,
+)
 from ipam.models import IPAddress
-from dcim.choices import DeviceStatusChoices
+from dcim.choices import DeviceStatusChoices, InterfaceTypeChoices
 from tenancy.models import Tenant
+from ..models import ObjectMap, Settings
 from .utilities import System
 
 
@@ -22,13 +41,14 @@ class Netbox:
             """
             if "system" in kwargs["task"]:
                 if Tenant.objects.filter(name=kwargs["tenant"]).exists() is False:
-                    Tenant.objects.create(
+                    __obj = Tenant.objects.create(
                         name=kwargs["tenant"],
                         slug=kwargs["slug"],
                         description="Managed by {}".format(
                             kwargs["tenant"],
                         ),
                     )
+                    System.Changelog.record(__obj, "create")
                 else:
                     Tenant.objects.filter(name=kwargs["tenant"]).update(
                         description="Managed by {}".format(
@@ -78,12 +98,57 @@ class Netbox:
                 if kwargs["tag"] not in __obj.tags.all():
                     # Add Cisco DNA Center Tag to NetBox Object
                     __obj.tags.add(kwargs["tag"])
-                    __obj.save()
+                    if System.Changelog.active is None:
+                        __obj.save()
+                    System.Changelog.record(__obj)
+            elif "bulk" in kwargs["task"]:
+                # Add Tag to many objects of the same model in a few statements
+                objects = [o for o in kwargs["objects"] if o is not None]
+                if len(objects) == 0:
+                    return
+                content_type = ContentType.objects.get_for_model(objects[0])
+                tagged = set(
+                    TaggedItem.objects.filter(
+                        content_type=content_type,
+                        tag=kwargs["tag"],
+                        object_id__in=[o.pk for o in objects],
+                    ).values_list("object_id", flat=True)
+                )
+                untagged = {o.pk: o for o in objects if o.pk not in tagged}
+                TaggedItem.objects.bulk_create(
+                    [
+                        TaggedItem(
+                            content_type=content_type,
+                            object_id=pk,
+                            tag=kwargs["tag"],
+                        )
+                        for pk in untagged
+                    ],
+                    batch_size=500,
+                )
+                for __obj in untagged.values():
+                    System.Changelog.record(__obj)
             else:
                 raise Exception("Not implemented yet")
 
         @staticmethod
-        def site(tenant, site):
+        def site_attributes(tenant, site):
+            """
+            NetBox Site field values for a Cisco DNA Center site (flat sync)
+
+            Shared with `Plan.sites`, the Tenant is left to the caller.
+            """
+            attrs = {
+                "name": site.siteNameHierarchy[0:100],
+                "slug": site.id[0:100],
+                "comments": site.id,
+                "description": "Managed by {}".format(tenant),
+            }
+            attrs.update(Netbox.Hierarchy.geo(site))
+            return attrs
+
+        @staticmethod
+        def site(tenant, site, pk=None):
             """
             Handle Site operations with NetBox
             """
@@ -91,62 +156,43 @@ class Netbox:
             # Match size in NetBox Database
             site.siteNameHierarchy = site.siteNameHierarchy[0:100]
             site.slug = site.slug[0:100]
+            attrs = Netbox.Sync.site_attributes(tenant, site)
+            geo = {
+                field: attrs.pop(field)
+                for field in ["physical_address", "latitude", "longitude"]
+                if field in attrs
+            }
 
-            # Gather site in Netbox (site name isn't unique, even with multiple tenants)
-            if Site.objects.filter(name=site.siteNameHierarchy).exists() is False:
-                Site.objects.create(
-                    name=site.siteNameHierarchy,
-                    slug=site.slug,
-                    comments=site.id,
-                    description="Managed by {}".format(tenant),
-                    tenant=Tenant.objects.get(name=tenant),
+            # Identity map resolves the Site, else match on name
+            # (site name isn't unique, even with multiple tenants)
+            __filter = {"name": site.siteNameHierarchy}
+            if pk is not None and Site.objects.filter(pk=pk).exists():
+                __filter = {"pk": pk}
+
+            # Gather site in Netbox
+            if Site.objects.filter(**__filter).exists() is False:
+                __obj = Site.objects.create(
+                    tenant=Tenant.objects.get(name=tenant), **attrs
                 )
+                System.Changelog.record(__obj, "create")
                 sync = "Created"
             else:
-                Site.objects.filter(name=site.siteNameHierarchy).update(
-                    slug=site.slug,
-                    comments=site.id,
-                    description="Managed by {}".format(tenant),
-                    tenant=Tenant.objects.get(name=tenant).id,
+                Site.objects.filter(**__filter).update(
+                    tenant=Tenant.objects.get(name=tenant).id, **attrs
                 )
                 sync = "Updated"
-            __obj = Site.objects.get(name=site.siteNameHierarchy)
-
-            # Check if additional information is avaible for the site
-            __save = False
-            if len(site.additionalInfo) != 0:
-                for additionalInfo in site.additionalInfo:
-                    if "Location" in additionalInfo["nameSpace"]:
-                        if additionalInfo["attributes"]["address"] is not None:
-                            if (
-                                __obj.physical_address
-                                != additionalInfo["attributes"]["address"]
-                            ):
-                                __obj.physical_address = additionalInfo["attributes"][
-                                    "address"
-                                ]
-                                __save = True
-                        if additionalInfo["attributes"]["latitude"] is not None:
-                            if __obj.latitude != Decimal(
-                                additionalInfo["attributes"]["latitude"]
-                            ):
-                                __obj.latitude = additionalInfo["attributes"][
-                                    "latitude"
-                                ]
-                                __save = True
-                        if additionalInfo["attributes"]["longitude"] is not None:
-                            if __obj.longitude != Decimal(
-                                additionalInfo["attributes"]["longitude"]
-                            ):
-                                __obj.longitude = additionalInfo["attributes"][
-                                    "longitude"
-                                ]
-                                __save = True
-            if __save is True:
+            __obj = Site.objects.get(**__filter)
+
+            # Address and coordinates, only when available in Cisco DNA Center
+            changed = [f for f, v in geo.items() if getattr(__obj, f) != v]
+            if len(changed) != 0:
                 # Only update Change log if something is updated
+                for field in changed:
+                    setattr(__obj, field, geo[field])
                 __obj.save()
+                System.Changelog.record(__obj)
 
-            return Site.objects.get(name=site.siteNameHierarchy), sync
+            return __obj, sync
 
         @staticmethod
         def manufacturer(manufacture, tenant):
@@ -156,11 +202,12 @@ class Netbox:
 
             # Gather manufacture in Netbox
             if Manufacturer.objects.filter(name=manufacture).exists() is False:
-                Manufacturer.objects.create(
+                __obj = Manufacturer.objects.create(
                     name=manufacture,
                     slug=manufacture.lower(),
                     description="Managed by {}".format(tenant),
                 )
+                System.Changelog.record(__obj, "create")
             else:
                 Manufacturer.objects.filter(name=manufacture).update(
                     slug=manufacture.lower(),
@@ -181,13 +228,14 @@ class Netbox:
                 ).exists()
                 is False
             ):
-                DeviceType.objects.create(
+                __obj = DeviceType.objects.create(
                     manufacturer=manufacture,
                     model=model,
                     slug=slug.lower(),
                     u_height=1,
                     comments="Managed by {}".format(tenant),
                 )
+                System.Changelog.record(__obj, "create")
             else:
                 DeviceType.objects.filter(manufacturer=manufacture, model=model).update(
                     slug=slug.lower(),
@@ -203,12 +251,13 @@ class Netbox:
 
             # Gather DeviceRole in Netbox
             if DeviceRole.objects.filter(name=role).exists() is False:
-                DeviceRole.objects.create(
+                __obj = DeviceRole.objects.create(
                     name=role,
                     slug=slug.lower(),
                     vm_role=False,
                     description="Managed by {}".format(tenant),
                 )
+                System.Changelog.record(__obj, "create")
             else:
                 DeviceRole.objects.filter(name=role).update(
                     slug=slug.lower(),
@@ -218,9 +267,20 @@ class Netbox:
             return DeviceRole.objects.get(name=role)
 
         @staticmethod
-        def device(tenant, device):
+        def status(device):
+            """
+            NetBox Device status of a Cisco DNA Center device (reachability)
+            """
+            if device.reachabilityStatus == "Reachable":
+                return DeviceStatusChoices.STATUS_ACTIVE
+            return DeviceStatusChoices.STATUS_FAILED
+
+        @staticmethod
+        def device(tenant, device, pk=None):
             """
             Handle Device operations with NetBox
+
+            Duplicate management IPs are resolved before, see `conflicts`.
             """
 
             # Match size in NetBox Database
@@ -228,135 +288,1090 @@ class Netbox:
             device.serialNumber = device.serialNumber[0:50]
 
             # Check device reachability in Cisco DNA Center
-            if device.reachabilityStatus == "Reachable":
-                device.status = DeviceStatusChoices.STATUS_ACTIVE
-            else:
-                device.status = DeviceStatusChoices.STATUS_FAILED
-
-            # Gather Device in Netbox
-            if Device.objects.filter(serial=device.serialNumber).exists() is False:
-                if Device.objects.filter(
-                    primary_ip4=device.primary_ip4,
-                    tenant=Tenant.objects.get(name=tenant).id,
-                ).exists():
-                    # There can't be duplicate IPs in one tenant.
-                    # But DNAC can register duplicate IPs, if only one is Reachable (within DNAC)
-                    Device.objects.create(
-                        name=device.hostname,
-                        device_role=device.role,
-                        device_type=device.family_type,
-                        serial=device.serialNumber,
-                        status=device.status,
-                        site=device.site,
-                        comments="Managed by {}".format(tenant),
-                        tenant=Tenant.objects.get(name=tenant),
+            device.status = Netbox.Sync.status(device)
+
+            attrs = {
+                "name": device.hostname,
+                "role": device.role,
+                "device_type": device.family_type,
+                "serial": device.serialNumber,
+                "status": device.status,
+                "site": device.site,
+                "location": device.floor,
+                "comments": "Managed by {}".format(tenant),
+                "tenant": Tenant.objects.get(name=tenant),
+            }
+
+            # Identity map resolves the Device (survives hostname and serial edits)
+            __obj = None
+            if pk is not None:
+                __obj = Device.objects.filter(pk=pk).first()
+            if __obj is None:
+                __obj = Device.objects.filter(serial=device.serialNumber).first()
+
+            if __obj is None:
+                __obj = Device.objects.create(**attrs)
+                System.Changelog.record(__obj, "create")
+                return __obj, "Created"
+
+            Device.objects.filter(pk=__obj.pk).update(**attrs)
+            for field, value in attrs.items():
+                setattr(__obj, field, value)
+            System.Changelog.record(__obj)
+
+            # IP Address is assigned to the Device in bulk, see `primary_ips`
+            return __obj, "Updated"
+
+        @staticmethod
+        def conflicts(tenant, devices):
+            """
+            Decide the owner of management IPs shared by several Devices
+
+            Reachable Devices win, then the Device holding the IP in NetBox,
+            then the lowest serial number. The NetBox holder competes even when
+            it isn't part of `devices` (e.g. a single Device refresh). Returns
+            owners (host: serial) and conflicts (host: serials that don't own
+            the IP).
+            """
+            by_host = {}
+            for device in devices:
+                host = System.Address.host(device.managementIpAddress)
+                if host is not None:
+                    by_host.setdefault(host, []).append(
+                        (
+                            device.serialNumber[0:50],
+                            device.reachabilityStatus == "Reachable",
+                        )
+                    )
+            if not by_host:
+                return {}, {}
+
+            # Current holders of the IPs in NetBox (Active when last reachable)
+            holders = {}
+            for address, serial, status in Device.objects.filter(
+                tenant__name=tenant, primary_ip4__address__net_in=list(by_host)
+            ).values_list("primary_ip4__address", "serial", "status"):
+                holders[str(address.ip)] = (
+                    serial,
+                    status == DeviceStatusChoices.STATUS_ACTIVE,
+                )
+
+            owners = {}
+            conflicts = {}
+            for host, candidates in by_host.items():
+                holder = holders.get(host)
+                outside = None
+                if holder is not None and holder[0] not in [c[0] for c in candidates]:
+                    # The holder isn't synced in this batch, it competes as is
+                    outside = holder[0]
+                    candidates = candidates + [holder]
+                candidates = sorted(
+                    candidates,
+                    key=lambda c: (
+                        not c[1],
+                        holder is None or holder[0] != c[0],
+                        c[0],
+                    ),
+                )
+                owners[host] = candidates[0][0]
+                losers = [c[0] for c in candidates[1:] if c[0] != outside]
+                if len(losers) != 0:
+                    conflicts[host] = losers
+            return owners, conflicts
+
+        @staticmethod
+        def ipaddress_attributes(tenant, device):
+            """
+            NetBox IPAddress field values of a Device management IP
+            """
+            return {
+                "dns_name": device.hostname,
+                "status": DeviceStatusChoices.STATUS_ACTIVE,
+                "description": "Managed by {}".format(tenant),
+            }
+
+        @staticmethod
+        def ipaddresses(tenant, devices, partial=False):
+            """
+            Handle IPAddress operations with NetBox in bulk
+
+            With `partial` (a few Devices), only their IPAddresses are preloaded.
+            """
+
+            # Preload IPAddresses of the Tenant, keyed by host address
+            __tenant = Tenant.objects.get(name=tenant)
+            queryset = IPAddress.objects.filter(tenant=__tenant)
+            if partial:
+                hosts = [System.Address.host(d.managementIpAddress) for d in devices]
+                hosts = [host for host in hosts if host is not None]
+                if len(hosts) == 0:
+                    return {}
+                queryset = queryset.filter(address__net_in=hosts)
+            index = {str(ip.address.ip): ip for ip in queryset}
+
+            # Gather missing and changed IPAddresses
+            create = {}
+            update = {}
+            for device in devices:
+                host = System.Address.host(device.managementIpAddress)
+                if host is None:
+                    continue
+                __obj = index.get(host)
+                attrs = Netbox.Sync.ipaddress_attributes(tenant, device)
+                if __obj is None:
+                    create[host] = IPAddress(
+                        address=str(ipaddress.ip_interface(host)),
+                        tenant=__tenant,
+                        **attrs,
+                    )
+                    index[host] = create[host]
+                elif __obj.pk is None:
+                    # Duplicate IP within the Cisco DNA Center inventory
+                    __obj.dns_name = device.hostname
+                elif any(getattr(__obj, f) != v for f, v in attrs.items()):
+                    for field, value in attrs.items():
+                        setattr(__obj, field, value)
+                    update[host] = __obj
+
+            IPAddress.objects.bulk_create(create.values(), batch_size=500)
+            IPAddress.objects.bulk_update(
+                update.values(),
+                ["dns_name", "status", "description"],
+                batch_size=500,
+            )
+            for __obj in create.values():
+                System.Changelog.record(__obj, "create")
+            for __obj in update.values():
+                System.Changelog.record(__obj)
+            return index
+
+        @staticmethod
+        def primary_ips(assignments):
+            """
+            Assign IPAddress as primary_ip4 to Devices in bulk (Device ID: IPAddress)
+            """
+            if len(assignments) == 0:
+                return
+
+            # There can't be duplicate IPs in one tenant, first Device wins
+            owners = {}
+            for device_id, ip in assignments.items():
+                owners.setdefault(ip.pk, device_id)
+            assignments = {
+                d: ip for d, ip in assignments.items() if owners[ip.pk] == d
+            }
+
+            # Assign IP Address to Device in NetBox
+            ips = []
+            for device_id, ip in assignments.items():
+                if ip.assigned_object_id != device_id:
+                    ip.assigned_object_id = device_id
+                    ips.append(ip)
+            IPAddress.objects.bulk_update(ips, ["assigned_object_id"], batch_size=500)
+
+            # Set primary_ip4 on Devices where it changed
+            devices = []
+            for __obj in Device.objects.filter(pk__in=assignments):
+                if __obj.primary_ip4_id != assignments[__obj.pk].pk:
+                    __obj.primary_ip4_id = assignments[__obj.pk].pk
+                    devices.append(__obj)
+            if len(devices) == 0:
+                return
+
+            # primary_ip4 is unique, release the IPs from previous owners first
+            Device.objects.filter(
+                primary_ip4__in=[d.primary_ip4_id for d in devices]
+            ).update(primary_ip4=None)
+            Device.objects.bulk_update(devices, ["primary_ip4"], batch_size=500)
+            for __obj in devices:
+                System.Changelog.record(__obj)
+
+        @staticmethod
+        def customfields(mapping):
+            """
+            Create missing Device custom fields for a Cisco DNA Center attribute mapping
+            """
+            object_type = ObjectType.objects.get_for_model(Device)
+            existing = {
+                cf.name: cf
+                for cf in CustomField.objects.filter(name__in=mapping.values())
+            }
+            for attribute, name in mapping.items():
+                __obj = existing.get(name)
+                if __obj is None:
+                    __obj = CustomField.objects.create(
+                        name=name,
+                        label=attribute,
+                        type=CustomFieldTypeChoices.TYPE_TEXT,
+                        description="Cisco DNA Center {}".format(attribute),
+                    )
+                    existing[name] = __obj
+                    System.Changelog.record(__obj, "create")
+                if not __obj.object_types.filter(pk=object_type.pk).exists():
+                    __obj.object_types.add(object_type)
+
+        @staticmethod
+        def attributes(devices, mapping, batch_size=500):
+            """
+            Write Cisco DNA Center attributes to Device custom fields in bulk
+
+            `devices` is Device ID: Cisco DNA Center Device. Only Devices whose
+            values changed are updated.
+            """
+            if len(devices) == 0 or len(mapping) == 0:
+                return 0
+            Netbox.Sync.customfields(mapping)
+
+            changed = []
+            pks = list(devices)
+            for i in range(0, len(pks), batch_size):
+                for __obj in Device.objects.filter(pk__in=pks[i : i + batch_size]):
+                    device = devices[__obj.pk]
+                    data = dict(__obj.custom_field_data)
+                    for attribute, name in mapping.items():
+                        value = device.get(attribute)
+                        data[name] = None if value in (None, "") else str(value)
+                    if data != __obj.custom_field_data:
+                        __obj.custom_field_data = data
+                        changed.append(__obj)
+
+            Device.objects.bulk_update(
+                changed, ["custom_field_data"], batch_size=batch_size
+            )
+            for __obj in changed:
+                System.Changelog.record(__obj)
+            return len(changed)
+
+    class Map:
+        """
+        Identity map between Cisco DNA Center UUIDs and NetBox objects
+        """
+
+        @staticmethod
+        def resolve(tenant, type):
+            """
+            Get all mapped NetBox object IDs for a Cisco DNA Center Instance
+            """
+            return dict(
+                ObjectMap.objects.filter(
+                    settings__hostname=tenant, object_type=type
+                ).values_list("dnac_id", "object_id")
+            )
+
+        @staticmethod
+        def lookup(tenant, type, dnac_ids):
+            """
+            Get mapped NetBox object IDs of some Cisco DNA Center UUIDs
+            """
+            return dict(
+                ObjectMap.objects.filter(
+                    settings__hostname=tenant, object_type=type, dnac_id__in=dnac_ids
+                ).values_list("dnac_id", "object_id")
+            )
+
+        @staticmethod
+        def record(tenant, type, mapping):
+            """
+            Save Cisco DNA Center UUID to NetBox object ID mapping in bulk
+            """
+            if len(mapping) == 0:
+                return
+            settings = Settings.objects.get(hostname=tenant)
+            now = timezone.now()
+            ObjectMap.objects.bulk_create(
+                [
+                    ObjectMap(
+                        settings=settings,
+                        object_type=type,
+                        dnac_id=dnac_id,
+                        object_id=object_id,
+                        last_seen=now,
+                    )
+                    for dnac_id, object_id in mapping.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["settings", "object_type", "dnac_id"],
+                update_fields=["object_id", "last_seen"],
+                batch_size=500,
+            )
+
+        @staticmethod
+        def prune(tenant, type, before, keep=()):
+            """
+            Remove mappings for Cisco DNA Center UUIDs not seen since `before`
+
+            Mappings of the NetBox object IDs in `keep` stay, e.g. objects that
+            couldn't be deleted yet.
+            """
+            return (
+                ObjectMap.objects.filter(
+                    settings__hostname=tenant, object_type=type, last_seen__lt=before
+                )
+                .exclude(object_id__in=list(keep))
+                .delete()[0]
+            )
+
+    class Hierarchy:
+        """
+        Sync Cisco DNA Center site tree into NetBox Regions, Sites and Locations
+        """
+
+        # Cisco DNA Center site type to NetBox model
+        MODELS = {
+            "global": Region,
+            "area": Region,
+            "building": Site,
+            "floor": Location,
+        }
+
+        # Expected NetBox model of the parent per site type
+        PARENTS = {
+            "global": None,
+            "area": Region,
+            "building": Region,
+            "floor": Site,
+        }
+
+        # Identity map type per NetBox model
+        TYPES = {
+            Region: "region",
+            Site: "site",
+            Location: "location",
+        }
+
+        @staticmethod
+        def location(site):
+            """
+            Get the Location attributes of a Cisco DNA Center site
+            """
+            for additionalInfo in site.additionalInfo or []:
+                if "Location" in additionalInfo["nameSpace"]:
+                    return additionalInfo["attributes"]
+            return {}
+
+        @classmethod
+        def geo(cls, site):
+            """
+            Address and coordinates of a Cisco DNA Center site, when available
+            """
+            attrs = {}
+            location = cls.location(site)
+            if location.get("address") is not None:
+                attrs["physical_address"] = location["address"]
+            for field in ["latitude", "longitude"]:
+                if location.get(field) is not None:
+                    attrs[field] = Decimal(str(location[field])).quantize(
+                        Decimal("0.000001")
                     )
-                    sync = "Error"
-                    return Device.objects.get(serial=device.serialNumber), sync
+            return attrs
+
+        @classmethod
+        def tree(cls, sites):
+            """
+            Build the Cisco DNA Center site tree in memory, parents first
+            """
+            levels = {}
+            for site in sites:
+                if site.siteNameHierarchy == "Global":
+                    site.type = "global"
                 else:
-                    Device.objects.create(
-                        name=device.hostname,
-                        device_role=device.role,
-                        device_type=device.family_type,
-                        primary_ip4=device.primary_ip4,
-                        serial=device.serialNumber,
-                        status=device.status,
-                        site=device.site,
-                        comments="Managed by {}".format(tenant),
-                        tenant=Tenant.objects.get(name=tenant),
+                    site.type = cls.location(site).get("type", "area")
+                site.depth = site.siteNameHierarchy.count("/")
+                levels.setdefault(site.depth, []).append(site)
+            return [levels[depth] for depth in sorted(levels)]
+
+        @classmethod
+        def attributes(cls, tenant, tenant_id, site, parent):
+            """
+            NetBox field values for a Cisco DNA Center site
+            """
+            description = "Managed by {}".format(tenant)
+            if site.type == "global":
+                # One root Region per Cisco DNA Center Instance
+                return {"name": tenant[0:100], "parent_id": None, "description": description}
+            if site.type == "area":
+                return {"name": site.name[0:100], "parent_id": parent.pk, "description": description}
+            if site.type == "building":
+                attrs = {
+                    "name": site.siteNameHierarchy[0:100],
+                    "region_id": parent.pk,
+                    "tenant_id": tenant_id,
+                    "comments": site.id,
+                    "description": description,
+                }
+                attrs.update(cls.geo(site))
+                return attrs
+            # Floors are Locations of the building Site
+            return {
+                "name": site.name[0:100],
+                "site_id": parent.pk,
+                "tenant_id": tenant_id,
+                "description": description,
+            }
+
+        @classmethod
+        def sync(cls, tenant, sites, tag, batch_size=500, purge=True):
+            """
+            Sync Cisco DNA Center sites level by level with bulk operations
+
+            Without `purge` (a partial tree), unseen Regions and Locations are kept.
+            """
+            __tenant = Tenant.objects.get(name=tenant)
+            started = timezone.now()
+            levels = cls.tree(sites)
+            ids = [site.id for level in levels for site in level]
+
+            # Preload existing objects by identity map and by slug (UUID)
+            existing = {}
+            for model, object_type in cls.TYPES.items():
+                mapping = Netbox.Map.resolve(tenant=tenant, type=object_type)
+                by_pk = {
+                    o.pk: o
+                    for o in model.objects.filter(
+                        Q(pk__in=list(mapping.values())) | Q(slug__in=ids)
+                    )
+                }
+                by_slug = {o.slug: o for o in by_pk.values()}
+                existing[model] = (mapping, by_pk, by_slug)
+
+            objects = {}
+            results = []
+            rebuild = set()
+            for level in levels:
+                create = {model: [] for model in cls.TYPES}
+                update = {model: {} for model in cls.TYPES}
+                fields = {model: set() for model in cls.TYPES}
+                for site in level:
+                    model = cls.MODELS.get(site.type)
+                    parent = objects.get(site.parentId)
+                    expected = cls.PARENTS.get(site.type)
+                    if model is None or (
+                        expected is not None and not isinstance(parent, expected)
+                    ):
+                        # Parent is missing or not of the expected type
+                        results.append(
+                            {
+                                "name": site.name,
+                                "status": "Failed",
+                                "status_label": "danger",
+                                "slug": site.id,
+                                "type": site.type,
+                                "sync_status": "Error",
+                            }
+                        )
+                        continue
+
+                    attrs = cls.attributes(tenant, __tenant.pk, site, parent)
+                    attrs["slug"] = site.id[0:100]
+                    mapping, by_pk, by_slug = existing[model]
+                    __obj = by_pk.get(mapping.get(site.id)) or by_slug.get(site.id)
+                    if __obj is None:
+                        __obj = model(**attrs)
+                        if model is not Site:
+                            # Tree fields are rebuilt after the bulk insert
+                            __obj.lft = __obj.rght = __obj.tree_id = __obj.level = 0
+                        create[model].append(__obj)
+                        sync = "Created"
+                    else:
+                        changed = [f for f, v in attrs.items() if getattr(__obj, f) != v]
+                        for field in changed:
+                            setattr(__obj, field, attrs[field])
+                        if len(changed) != 0:
+                            update[model][__obj.pk] = __obj
+                            fields[model].update(changed)
+                        sync = "Updated"
+                    objects[site.id] = __obj
+                    results.append(
+                        {
+                            "name": site.name,
+                            "status": "Active",
+                            "status_label": "success",
+                            "slug": site.id,
+                            "type": site.type,
+                            "sync_status": sync,
+                        }
                     )
-                    sync = "Created"
+
+                # Parents are saved before the next level of children
+                for model in cls.TYPES:
+                    model.objects.bulk_create(create[model], batch_size=batch_size)
+                    if update[model] and fields[model]:
+                        model.objects.bulk_update(
+                            update[model].values(), fields[model], batch_size=batch_size
+                        )
+                    for __obj in create[model]:
+                        System.Changelog.record(__obj, "create")
+                    for __obj in update[model].values():
+                        System.Changelog.record(__obj)
+                    if model is not Site and (create[model] or update[model]):
+                        rebuild.add(model)
+
+            # Rebuild MPTT trees that were changed in bulk
+            for model in rebuild:
+                model.objects.rebuild()
+
+            # Add tag and update identity map
+            for model, object_type in cls.TYPES.items():
+                synced = {k: o for k, o in objects.items() if isinstance(o, model)}
+                Netbox.Sync.tags(task="bulk", objects=list(synced.values()), tag=tag)
+                Netbox.Map.record(
+                    tenant=tenant,
+                    type=object_type,
+                    mapping={k: o.pk for k, o in synced.items()},
+                )
+
+            # Remove Regions and Locations that are gone in Cisco DNA Center
+            if purge:
+                results += cls.purge(tenant=tenant, before=started)
+            return results
+
+        @staticmethod
+        def purge(tenant, before):
+            """
+            Delete Regions and Locations not seen in the Cisco DNA Center site tree
+
+            Objects still referenced by protected relations (e.g. a Location
+            with racks or devices) are kept and reported as errors. Their
+            mapping stays, so the next run retries the delete.
+            """
+            errors = []
+            for model, object_type in [(Location, "location"), (Region, "region")]:
+                stale = ObjectMap.objects.filter(
+                    settings__hostname=tenant,
+                    object_type=object_type,
+                    last_seen__lt=before,
+                ).values_list("object_id", flat=True)
+                protected = []
+                # Children first, a parent isn't deleted from under them
+                for __obj in model.objects.filter(pk__in=list(stale)).order_by("-level"):
+                    System.Changelog.record(__obj, "delete")
+                    try:
+                        with transaction.atomic():
+                            __obj.delete()
+                    except ProtectedError as error:
+                        System.Changelog.discard(__obj)
+                        protected.append(__obj.pk)
+                        errors.append(
+                            {
+                                "name": __obj.name,
+                                "status": "Failed",
+                                "status_label": "danger",
+                                "slug": __obj.slug,
+                                "type": object_type,
+                                "sync_status": "Error: in use by {} object(s)".format(
+                                    len(error.protected_objects)
+                                ),
+                            }
+                        )
+                Netbox.Map.prune(
+                    tenant=tenant, type=object_type, before=before, keep=protected
+                )
+            return errors
+
+        @staticmethod
+        def index(tenant, slugs=None):
+            """
+            In-memory index of Cisco DNA Center site UUID to NetBox (Site, Location)
+
+            With `slugs`, only these Cisco DNA Center sites are indexed.
+            """
+            sites = Site.objects.filter(tenant__name=tenant)
+            locations = Location.objects.filter(tenant__name=tenant)
+            if slugs is not None:
+                slugs = [slug for slug in slugs if slug is not None]
+                sites = sites.filter(slug__in=slugs)
+                locations = locations.filter(slug__in=slugs)
+            index = {}
+            for site in sites:
+                index[site.slug] = (site, None)
+            for location in locations.select_related("site"):
+                index[location.slug] = (location.site, location)
+            return index
+
+    class Plan:
+        """
+        Compute the changes of a sync in memory, without writing to NetBox
+        """
+
+        @staticmethod
+        def diff(plan, key, name, current, desired):
+            """
+            Add a create, update or unchanged entry with field level changes
+            """
+            if current is None:
+                plan["create"].append({"id": key, "name": name, "changes": desired})
+                return
+            changes = {
+                field: [current.get(field), value]
+                for field, value in desired.items()
+                if current.get(field) != value
+            }
+            if len(changes) == 0:
+                plan["unchanged"] += 1
             else:
-                try:
-                    # There can't be duplicate IPs in one tenant.
-                    # But DNAC can register duplicate IPs, if only one is Reachable (within DNAC)
-                    device.serialNumber = Device.objects.get(
-                        primary_ip4=device.primary_ip4,
-                        tenant=Tenant.objects.get(name=tenant).id,
-                    ).serial
-                    Device.objects.filter(
-                        serial=device.serialNumber,
-                        tenant=Tenant.objects.get(name=tenant).id,
-                    ).update(
-                        name=device.hostname,
-                        device_role=device.role,
-                        device_type=device.family_type,
-                        primary_ip4=device.primary_ip4,
-                        status=device.status,
-                        site=device.site,
-                        comments="Managed by {}".format(tenant),
-                        tenant=Tenant.objects.get(name=tenant).id,
+                plan["update"].append({"id": key, "name": name, "changes": changes})
+
+        @staticmethod
+        def new():
+            return {"create": [], "update": [], "delete": [], "error": [], "unchanged": 0}
+
+        @classmethod
+        def sites(cls, tenant, sites):
+            """
+            Plan flat Site sync (one Site per Cisco DNA Center site)
+            """
+            plan = cls.new()
+            mapping = Netbox.Map.resolve(tenant=tenant, type="site")
+            names = []
+            for site in sites:
+                if site.siteNameHierarchy == "Global":
+                    site.siteNameHierarchy = "{} {}".format(
+                        site.siteNameHierarchy, site.id.split("-")[0]
                     )
-                    sync = "Updated"
-                except Exception as error_msg:
-                    print(error_msg)
-                    Device.objects.filter(
-                        serial=device.serialNumber,
-                        tenant=Tenant.objects.get(name=tenant).id,
-                    ).update(
-                        name=device.hostname,
-                        device_role=device.role,
-                        device_type=device.family_type,
-                        status=device.status,
-                        site=device.site,
-                        comments="Managed by {}".format(tenant),
-                        tenant=Tenant.objects.get(name=tenant).id,
+                site.siteNameHierarchy = site.siteNameHierarchy[0:100]
+                names.append(site.siteNameHierarchy)
+
+            # NetBox state for the Tenant
+            fields = [
+                "pk",
+                "name",
+                "slug",
+                "comments",
+                "description",
+                "physical_address",
+                "latitude",
+                "longitude",
+                "tenant__name",
+            ]
+            current = Site.objects.filter(
+                Q(tenant__name=tenant)
+                | Q(name__in=names)
+                | Q(pk__in=list(mapping.values()))
+            ).values(*fields)
+            by_pk = {s["pk"]: s for s in current}
+            by_name = {s["name"]: s for s in by_pk.values()}
+
+            for site in sites:
+                existing = by_pk.get(mapping.get(site.id)) or by_name.get(
+                    site.siteNameHierarchy
+                )
+                desired = Netbox.Sync.site_attributes(tenant, site)
+                desired["tenant__name"] = tenant
+                cls.diff(plan, site.id, site.siteNameHierarchy, existing, desired)
+
+            # Purge of Sites removed in Cisco DNA Center
+            stale = set(
+                Netbox.Purge.stale(
+                    [s["slug"] for s in by_pk.values() if s["tenant__name"] == tenant],
+                    [site.id[0:100] for site in sites],
+                )
+            )
+            plan["delete"] = [
+                {"id": s["slug"], "name": s["name"]}
+                for s in by_pk.values()
+                if s["tenant__name"] == tenant and s["slug"] in stale
+            ]
+            return {"sites": plan}
+
+        @classmethod
+        def hierarchy(cls, tenant, sites):
+            """
+            Plan hierarchical sync into Regions, Sites and Locations
+            """
+            plans = {model: cls.new() for model in Netbox.Hierarchy.TYPES}
+            levels = Netbox.Hierarchy.tree(sites)
+            ids = [site.id for level in levels for site in level]
+            existing = {}
+            for model, object_type in Netbox.Hierarchy.TYPES.items():
+                mapping = Netbox.Map.resolve(tenant=tenant, type=object_type)
+                by_pk = {
+                    o.pk: o
+                    for o in model.objects.filter(
+                        Q(pk__in=list(mapping.values())) | Q(slug__in=ids)
                     )
-                    sync = "Error"
-                    pass
+                }
+                by_slug = {o.slug: o for o in by_pk.values()}
+                existing[model] = (mapping, by_pk, by_slug)
 
-            # Assign IP Address to Device in NetBox
-            IPAddress.objects.filter(
-                address=str(device.primary_ip4),
-                tenant=Tenant.objects.get(name=tenant).id,
-            ).update(
-                assigned_object_id=Device.objects.get(serial=device.serialNumber).id,
+            tenant_id = (
+                Tenant.objects.filter(name=tenant).values_list("pk", flat=True).first()
             )
+            objects = {}
+            for level in levels:
+                for site in level:
+                    model = Netbox.Hierarchy.MODELS.get(site.type)
+                    parent = objects.get(site.parentId)
+                    expected = Netbox.Hierarchy.PARENTS.get(site.type)
+                    if model is None or (
+                        expected is not None and not isinstance(parent, expected)
+                    ):
+                        plans[model or Site]["error"].append(
+                            {"id": site.id, "name": site.name, "error": "Parent not found"}
+                        )
+                        continue
+                    attrs = Netbox.Hierarchy.attributes(tenant, tenant_id, site, parent)
+                    attrs["slug"] = site.id[0:100]
+                    mapping, by_pk, by_slug = existing[model]
+                    __obj = by_pk.get(mapping.get(site.id)) or by_slug.get(site.id)
+                    cls.diff(
+                        plans[model],
+                        site.id,
+                        site.siteNameHierarchy,
+                        None if __obj is None else {f: getattr(__obj, f) for f in attrs},
+                        attrs,
+                    )
+                    # Planned (unsaved) object stands in as parent of the next level
+                    objects[site.id] = __obj or model(**attrs)
 
-            return Device.objects.get(serial=device.serialNumber), sync
+            # Purge of objects removed in Cisco DNA Center
+            for model, (mapping, by_pk, by_slug) in existing.items():
+                plans[model]["delete"] = [
+                    {"id": dnac_id, "name": str(by_pk[pk])}
+                    for dnac_id, pk in mapping.items()
+                    if dnac_id not in objects and pk in by_pk
+                ]
+            return {
+                "regions": plans[Region],
+                "sites": plans[Site],
+                "locations": plans[Location],
+            }
 
-        @staticmethod
-        def ipaddress(tenant, address, hostname):
+        @classmethod
+        def devices(cls, tenant, devices, site_members, owners=None):
             """
-            Handle IPAddress operations with NetBox
+            Plan Device and IP Address sync
+
+            Same decisions as the sync: Devices owned by another Cisco DNA
+            Center (`owners`, Serial: hostname) are skipped and kept, shared
+            management IPs go to the Device chosen by `Sync.conflicts`.
             """
-            # Gather IPAddress in Netbox
-            if (
-                IPAddress.objects.filter(
-                    address=address, tenant=Tenant.objects.get(name=tenant).id
-                ).exists()
-                is False
-            ):
-                IPAddress.objects.create(
-                    address=address,
-                    status=DeviceStatusChoices.STATUS_ACTIVE,
-                    dns_name=hostname,
-                    description="Managed by {}".format(tenant),
-                    tenant=Tenant.objects.get(name=tenant),
+            plan = cls.new()
+            ip_plan = cls.new()
+            owners = owners or {}
+            devices = [
+                d
+                for d in devices
+                if d.deviceSupportLevel == "Supported"
+                and owners.get(d.serialNumber[0:50], tenant) == tenant
+            ]
+            mapping = Netbox.Map.resolve(tenant=tenant, type="device")
+            serials = [d.serialNumber[0:50] for d in devices]
+            ip_owners, conflicts = Netbox.Sync.conflicts(tenant=tenant, devices=devices)
+
+            # NetBox state for the Tenant
+            fields = [
+                "pk",
+                "name",
+                "serial",
+                "status",
+                "site__slug",
+                "location__slug",
+                "role__name",
+                "device_type__model",
+                "tenant__name",
+                "primary_ip4__address",
+            ]
+            by_pk = {
+                d["pk"]: d
+                for d in Device.objects.filter(
+                    Q(tenant__name=tenant)
+                    | Q(serial__in=serials)
+                    | Q(pk__in=list(mapping.values()))
+                ).values(*fields)
+            }
+            by_serial = {d["serial"]: d for d in by_pk.values()}
+            for d in by_pk.values():
+                d["primary_ip4__address"] = System.Address.host(
+                    str(d["primary_ip4__address"] or "")
+                )
+            ips = {
+                str(ip["address"].ip): ip
+                for ip in IPAddress.objects.filter(tenant__name=tenant).values(
+                    "address", "dns_name", "status", "description"
+                )
+            }
+            site_index = {
+                slug: (site.slug, location.slug if location else None)
+                for slug, (site, location) in Netbox.Hierarchy.index(tenant).items()
+            }
+
+            for device in devices:
+                serial = device.serialNumber[0:50]
+                host = System.Address.host(device.managementIpAddress)
+                placement = site_index.get(site_members.get(device.serialNumber))
+                if placement is None:
+                    plan["error"].append(
+                        {"id": serial, "name": device.hostname, "error": "Site not found"}
+                    )
+                    continue
+
+                # Only the owner of a shared management IP gets it
+                owned = host is not None and ip_owners.get(host) == serial
+                if serial in conflicts.get(host, []):
+                    plan["error"].append(
+                        {
+                            "id": serial,
+                            "name": device.hostname,
+                            "error": "Duplicate IP {} (owned by {})".format(
+                                host, ip_owners[host]
+                            ),
+                        }
+                    )
+                current = by_pk.get(mapping.get(device.id)) or by_serial.get(serial)
+                desired = {
+                    "name": device.hostname[0:100],
+                    "serial": serial,
+                    "status": Netbox.Sync.status(device),
+                    "site__slug": placement[0],
+                    "location__slug": placement[1],
+                    "role__name": device.role,
+                    "device_type__model": device.family,
+                    "tenant__name": tenant,
+                }
+                if owned:
+                    desired["primary_ip4__address"] = host
+                cls.diff(plan, serial, device.hostname, current, desired)
+                if owned:
+                    attrs = Netbox.Sync.ipaddress_attributes(tenant, device)
+                    cls.diff(ip_plan, host, host, ips.get(host), attrs)
+                    ips.setdefault(host, attrs)
+
+            # Purge of Devices removed in Cisco DNA Center, unless another
+            # Cisco DNA Center still reports them
+            stale = set(
+                Netbox.Purge.stale(
+                    [d["serial"] for d in by_pk.values() if d["tenant__name"] == tenant],
+                    serials,
+                    keep=owners,
                 )
+            )
+            plan["delete"] = [
+                {"id": d["serial"], "name": d["name"]}
+                for d in by_pk.values()
+                if d["tenant__name"] == tenant and d["serial"] in stale
+            ]
+            return {"devices": plan, "ipaddresses": ip_plan}
+
+    class Interfaces:
+        """
+        Sync Cisco DNA Center Interfaces into NetBox, one page at a time
+
+        Only one page of Interfaces is held in memory. Changes are written with
+        bulk create/update per page, Interfaces gone in Cisco DNA Center are
+        deleted in chunks based on the identity map.
+        """
+
+        # Component fields cached from the Device (NetBox 4.3+)
+        CACHED = ["_site", "_location", "_rack"]
+
+        @staticmethod
+        def number(value, low=1, high=None):
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                return None
+            if value < low or (high is not None and value > high):
+                return None
+            return value
+
+        @classmethod
+        def attributes(cls, interface, device):
+            """
+            NetBox Interface fields of a Cisco DNA Center Interface
+            """
+            if (interface.get("interfaceType") or "").lower() == "virtual":
+                type = InterfaceTypeChoices.TYPE_VIRTUAL
             else:
-                IPAddress.objects.filter(
-                    address=address, tenant=Tenant.objects.get(name=tenant).id
-                ).update(
-                    status=DeviceStatusChoices.STATUS_ACTIVE,
-                    dns_name=hostname,
-                    description="Managed by {}".format(tenant),
-                    tenant=Tenant.objects.get(name=tenant).id,
+                type = InterfaceTypeChoices.TYPE_OTHER
+            return {
+                "device_id": device,
+                "name": interface.get("portName")[0:64],
+                "type": type,
+                "enabled": (interface.get("adminStatus") or "").upper() == "UP",
+                "mtu": cls.number(interface.get("mtu"), high=65536),
+                # Kbps in both Cisco DNA Center and NetBox
+                "speed": cls.number(interface.get("speed")),
+                "description": (interface.get("description") or "")[0:200],
+            }
+
+        @classmethod
+        def sync(cls, tenant, pages, tag, batch_size=500, deadline=None):
+            """
+            Sync pages of Cisco DNA Center Interfaces for the synced Devices
+            """
+            results = {
+                "created": 0,
+                "updated": 0,
+                "unchanged": 0,
+                "skipped": 0,
+                "deleted": 0,
+            }
+            devices = Netbox.Map.resolve(tenant=tenant, type="device")
+            fields = {f.name for f in Interface._meta.concrete_fields}
+            cached = [f for f in cls.CACHED if f in fields]
+            started = timezone.now()
+
+            for page in pages:
+                # Stop cleanly when the time budget is spent, nothing is purged
+                if deadline is not None and deadline.expired():
+                    results["sync_status"] = "Error: Deadline reached"
+                    return results
+
+                # Desired state of the Interfaces of the page
+                records = {}
+                names = set()
+                for interface in page:
+                    device = devices.get(interface.get("deviceId"))
+                    if device is None or not interface.get("portName"):
+                        # Device isn't synced (e.g. unsupported) or no name
+                        results["skipped"] += 1
+                        continue
+                    attrs = cls.attributes(interface, device)
+                    if (device, attrs["name"]) in names:
+                        results["skipped"] += 1
+                        continue
+                    names.add((device, attrs["name"]))
+                    records[interface.get("id")] = attrs
+
+                # Existing Interfaces, by identity map or by Device and name
+                mapped = Netbox.Map.lookup(
+                    tenant=tenant, type="interface", dnac_ids=list(records)
                 )
+                existing = Interface.objects.in_bulk(list(mapped.values()))
+                unmapped = {
+                    (attrs["device_id"], attrs["name"]): dnac_id
+                    for dnac_id, attrs in records.items()
+                    if existing.get(mapped.get(dnac_id)) is None
+                }
+                if len(unmapped) != 0:
+                    for __obj in Interface.objects.filter(
+                        device_id__in={k[0] for k in unmapped},
+                        name__in={k[1] for k in unmapped},
+                    ):
+                        dnac_id = unmapped.get((__obj.device_id, __obj.name))
+                        if dnac_id is not None:
+                            mapped[dnac_id] = __obj.pk
+                            existing[__obj.pk] = __obj
+
+                # Placement of the Devices for cached component fields
+                placement = {}
+                if len(cached) != 0:
+                    for device in Device.objects.filter(
+                        pk__in={a["device_id"] for a in records.values()}
+                    ).values("pk", "site_id", "location_id", "rack_id"):
+                        placement[device["pk"]] = {
+                            "_site_id": device["site_id"],
+                            "_location_id": device["location_id"],
+                            "_rack_id": device["rack_id"],
+                        }
+
+                create = {}
+                update = []
+                changed_fields = set()
+                seen = {}
+                for dnac_id, attrs in records.items():
+                    for field in cached:
+                        attrs["{}_id".format(field)] = placement.get(
+                            attrs["device_id"], {}
+                        ).get("{}_id".format(field))
+                    __obj = existing.get(mapped.get(dnac_id))
+                    if __obj is None:
+                        create[dnac_id] = Interface(**attrs)
+                        continue
+                    seen[dnac_id] = __obj.pk
+                    changed = [f for f, v in attrs.items() if getattr(__obj, f) != v]
+                    if len(changed) == 0:
+                        results["unchanged"] += 1
+                        continue
+                    for field in changed:
+                        setattr(__obj, field, attrs[field])
+                    if "name" in changed and "_name" in fields:
+                        # Natural ordering of the name (NetBox < 4.3)
+                        Interface._meta.get_field("_name").pre_save(__obj, False)
+                        changed.append("_name")
+                    changed_fields.update(
+                        f[0:-3] if f.endswith("_id") else f for f in changed
+                    )
+                    update.append(__obj)
+
+                # Apply the page in one short transaction
+                with transaction.atomic():
+                    Interface.objects.bulk_create(
+                        list(create.values()), batch_size=batch_size
+                    )
+                    if len(update) != 0:
+                        Interface.objects.bulk_update(
+                            update, list(changed_fields), batch_size=batch_size
+                        )
+                    # bulk_create doesn't send post_save, fix the counter cache
+                    cls.counters(
+                        {o.device_id for o in create.values()}
+                        | {o.device_id for o in update if "device" in changed_fields}
+                    )
+                results["created"] += len(create)
+                results["updated"] += len(update)
+
+                Netbox.Sync.tags(task="bulk", objects=list(create.values()), tag=tag)
+                seen.update({dnac_id: o.pk for dnac_id, o in create.items()})
+                Netbox.Map.record(tenant=tenant, type="interface", mapping=seen)
+                System.Progress.step(len(page))
+
+            # Remove Interfaces that are gone in Cisco DNA Center
+            results["deleted"] = cls.purge(
+                tenant=tenant, before=started, batch_size=batch_size
+            )
+            return results
 
-            for v in IPAddress.objects.filter(address=address):
-                if tenant == v.tenant:
-                    return IPAddress.objects.get(id=v.id)
-            return IPAddress.objects.get(
-                address=address, tenant=Tenant.objects.get(name=tenant).id
+        @staticmethod
+        def counters(devices):
+            """
+            Recompute the Interface counter cache of Devices
+            """
+            if len(devices) == 0 or not hasattr(Device, "interface_count"):
+                return
+            count = (
+                Interface.objects.filter(device_id=OuterRef("pk"))
+                .order_by()
+                .values("device_id")
+                .annotate(count=Count("pk"))
+                .values("count")
+            )
+            Device.objects.filter(pk__in=devices).update(
+                interface_count=Coalesce(Subquery(count), 0)
+            )
+
+        @staticmethod
+        def purge(tenant, before, batch_size=500):
+            """
+            Delete synced Interfaces not seen since `before`, in chunks
+            """
+            stale = ObjectMap.objects.filter(
+                settings__hostname=tenant, object_type="interface", last_seen__lt=before
+            ).values("object_id")
+            deleted = sum(
+                Netbox.Purge.chunks(
+                    Interface.objects.filter(pk__in=stale), chunk_size=batch_size
+                )
             )
+            Netbox.Map.prune(tenant=tenant, type="interface", before=before)
+            return deleted
 
     class Purge:
+        @staticmethod
+        def stale(netbox, dnac, keep=()):
+            """
+            Keys in NetBox that are gone in Cisco DNA Center (shared with `Plan`)
+            """
+            return list(set(netbox) - set(dnac) - set(keep))
+
         @staticmethod
         def database(**kwargs):
             """
             Purge data from NetBox Database - when running Sync
+
+            `scope` (Q object) limits the purge, e.g. to a site subtree.
             """
+            scope = kwargs.get("scope", Q())
 
             # Delete devices related to Tenant
             if kwargs["type"] == "devices":
@@ -366,7 +1381,7 @@ class Netbox:
                     d.serial
                     for d in Device.objects.filter(
                         tenant=Tenant.objects.get(name=kwargs["tenant"]).id
-                    )
+                    ).filter(scope)
                 ]
 
                 # Unique Serial Numbers in Cisco DNA Center Instance
@@ -374,21 +1389,31 @@ class Netbox:
                 for d in kwargs["data"]:
                     dnac_serials.append(d["serial"])
 
-                # Diff between NetBox and Cisco DNA Center Instance
-                purge = list(set(netbox_serials) - set(dnac_serials))
+                # Diff between NetBox and Cisco DNA Center Instance, keeping
+                # Devices reported by other Cisco DNA Center Instances
+                purge = Netbox.Purge.stale(
+                    netbox_serials, dnac_serials, keep=kwargs.get("keep", ())
+                )
 
                 if len(purge) == 0:
                     return False
                 else:
 
                     # Remove diff in NetBox
+                    deleted = []
                     try:
-                        for serial in purge:
-                            Device.objects.filter(
-                                id=Device.objects.get(serial=serial).id
-                            ).delete()
+                        queryset = Device.objects.filter(
+                            tenant=Tenant.objects.get(name=kwargs["tenant"]).id,
+                            serial__in=purge,
+                        )
+                        deleted = list(queryset)
+                        for __obj in deleted:
+                            System.Changelog.record(__obj, "delete")
+                        queryset.delete()
                         return True
                     except Exception as error_msg:
+                        for __obj in deleted:
+                            System.Changelog.discard(__obj)
                         print(
                             "Error couldn't delete {}\n{}".format(
                                 kwargs["data"], error_msg
@@ -403,7 +1428,7 @@ class Netbox:
                     s.slug
                     for s in Site.objects.filter(
                         tenant=Tenant.objects.get(name=kwargs["tenant"]).id
-                    )
+                    ).filter(scope)
                 ]
 
                 # Unique Site id/uuid in Cisco DNA Center Instance
@@ -412,18 +1437,24 @@ class Netbox:
                     dnac_sites.append(s["slug"])
 
                 # Diff between NetBox and Cisco DNA Center Instance
-                purge = list(set(netbox_sites) - set(dnac_sites))
+                purge = Netbox.Purge.stale(netbox_sites, dnac_sites)
 
                 if len(purge) == 0:
                     return False
                 else:
 
                     # Remove diff in NetBox
+                    deleted = []
                     try:
-                        for uuid in purge:
-                            Site.objects.filter(slug=uuid).delete()
+                        queryset = Site.objects.filter(slug__in=purge)
+                        deleted = list(queryset)
+                        for __obj in deleted:
+                            System.Changelog.record(__obj, "delete")
+                        queryset.delete()
                         return True
                     except Exception as error_msg:
+                        for __obj in deleted:
+                            System.Changelog.discard(__obj)
                         print(
                             "Error couldn't delete {}\n{}".format(
                                 kwargs["data"], error_msg
@@ -437,45 +1468,57 @@ class Netbox:
         def tenant(cls, **kwargs):
             """
             Delete Tenant related to Cisco DNA Center Instance
+
+            Objects are deleted in chunks, so an interrupted purge is resumed
+            by running it again. Counters are kept in the cache meanwhile.
             """
 
             # Get NetBox tenants based on Cisco DNA Center Tag
             results = {}
             dnac_tag = System.PluginTag.get()
             tenant_name = get_object_or_404(Tenant, pk=kwargs["pk"], tags=dnac_tag).name
+            key = "netbox_ciscodnac_plugin_purge_{}".format(kwargs["pk"])
+            results[tenant_name] = cache.get(key) or {
+                "devices": 0,
+                "ipaddress": 0,
+                "sites": 0,
+            }
 
             # Delete objects based on dependencies until Tenant is deleted
-            results[tenant_name] = {}
-            results[tenant_name]["devices"] = cls.devices(**kwargs)
-            results[tenant_name]["ipaddress"] = cls.ipaddress(**kwargs)
-            results[tenant_name]["sites"] = cls.sites(**kwargs)
+            for name, model in [
+                ("devices", Device),
+                ("ipaddress", IPAddress),
+                ("sites", Site),
+            ]:
+                queryset = model.objects.filter(tenant=kwargs["pk"])
+                System.Progress.phase("purge {}".format(name), tenant=tenant_name)
+                System.Progress.total(queryset.count())
+                for deleted in cls.chunks(
+                    queryset, chunk_size=System.Config.get("batch_size", 500)
+                ):
+                    results[tenant_name][name] += deleted
+                    cache.set(key, results[tenant_name], timeout=86400)
             Tenant.objects.filter(pk=kwargs["pk"]).delete()
+            cache.delete(key)
 
             return results
 
-        @classmethod
-        def devices(cls, **kwargs):
-            """
-            Delete Devices related to Cisco DNA Center Instance
-            """
-            result = Device.objects.filter(tenant=kwargs["pk"]).count()
-            Device.objects.filter(tenant=kwargs["pk"]).delete()
-            return result
-
-        @classmethod
-        def ipaddress(cls, **kwargs):
-            """
-            Delete IPAddress related to Cisco DNA Center Instance
-            """
-            result = IPAddress.objects.filter(tenant=kwargs["pk"]).count()
-            IPAddress.objects.filter(tenant=kwargs["pk"]).delete()
-            return result
-
-        @classmethod
-        def sites(cls, **kwargs):
+        @staticmethod
+        def chunks(queryset, chunk_size=500):
             """
-            Delete Sites related to Cisco DNA Center Instance
+            Delete a queryset in primary key ordered chunks, one short transaction each
             """
-            result = Site.objects.filter(tenant=kwargs["pk"]).count()
-            Site.objects.filter(tenant=kwargs["pk"]).delete()
-            return result
+            last = 0
+            while True:
+                pks = list(
+                    queryset.filter(pk__gt=last)
+                    .order_by("pk")
+                    .values_list("pk", flat=True)[0:chunk_size]
+                )
+                if len(pks) == 0:
+                    return
+                with transaction.atomic():
+                    queryset.model.objects.filter(pk__in=pks).delete()
+                last = pks[-1]
+                System.Progress.step(len(pks))
+                yield len(pks)
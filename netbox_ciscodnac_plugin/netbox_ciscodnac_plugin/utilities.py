@@ -1,9 +1,31 @@
+import io
 import re
-from django_rq import get_worker
-from django_rq.queues import get_connection
+import time
+import uuid
+import marshal
+import pstats
+import cProfile
+import functools
+import ipaddress
+import tracemalloc
+from contextlib import contextmanager
+from django.core.cache import cache
+from rq import get_current_job
+from rq import Worker
+from django_rq import get_queue
 from extras.models import Tag
-from dcim.models import Site
+from dcim.models import Device, Site
 from tenancy.models import Tenant
+from netbox.context import current_request
+from netbox.plugins.utils import get_plugin_config
+
+try:
+    from core.choices import ObjectChangeActionChoices
+    from core.models import ObjectChange
+except ImportError:
+    # NetBox 4.0
+    from extras.choices import ObjectChangeActionChoices
+    from extras.models import ObjectChange
 
 
 class System:
@@ -11,6 +33,14 @@ class System:
     Support functions for the Plugin
     """
 
+    class Config:
+        @staticmethod
+        def get(name, default=None):
+            """
+            Get plugin setting from PLUGINS_CONFIG
+            """
+            return get_plugin_config("netbox_ciscodnac_plugin", name, default)
+
     class Check:
         @classmethod
         def tenant(cls, tenant):
@@ -24,6 +54,10 @@ class System:
                     return True
             return False
 
+        @classmethod
+        def devices(cls, tenant):
+            return Device.objects.filter(tenant__name=tenant).exists()
+
     class PluginTag:
         @staticmethod
         def get():
@@ -37,9 +71,376 @@ class System:
         def create(input):
             return re.sub(r"[\s\/]+", "-", input).lower()
 
+    class Address:
+        @staticmethod
+        def host(address):
+            """
+            Normalize an IP Address (with or without prefix) to the host address
+            """
+            if not address:
+                return None
+            try:
+                return str(ipaddress.ip_interface(address).ip)
+            except ValueError:
+                return None
+
     class RQ:
+        """
+        RQ queues of the plugin per priority (`queues` in PLUGINS_CONFIG)
+
+        `high` for single Device, Site and subtree refreshes, `normal` for
+        other work and `low` for full syncs and purges.
+        """
+
+        PRIORITIES = ["high", "normal", "low"]
+
         @staticmethod
-        def status():
-            if get_worker("default").count(get_connection("default")) == 0:
-                return False
+        def queue(priority="normal"):
+            """
+            RQ queue configured for a priority
+            """
+            queues = System.Config.get("queues", {})
+            return get_queue(queues.get(priority, "default"))
+
+        @classmethod
+        def status(cls, priority=None):
+            """
+            Check that workers listen on the queue of a priority (or on all)
+            """
+            priorities = cls.PRIORITIES if priority is None else [priority]
+            for priority in priorities:
+                if Worker.count(queue=cls.queue(priority)) == 0:
+                    return False
             return True
+
+        @classmethod
+        def fetch_job(cls, id):
+            """
+            Get RQ Job by ID from any of the configured queues
+            """
+            names = set()
+            for priority in cls.PRIORITIES:
+                queue = cls.queue(priority)
+                if queue.name in names:
+                    continue
+                names.add(queue.name)
+                job = queue.fetch_job(str(id))
+                if job is not None:
+                    return job
+            return None
+
+    class Changelog:
+        """
+        Batched changelog for plugin driven updates
+
+        While active, NetBox doesn't create an ObjectChange per save(). A
+        single summary ObjectChange per changed object is written in bulk
+        for every `batch_size` objects and when leaving the context.
+        """
+
+        active = None
+
+        def __init__(self, enabled=False, batch_size=500):
+            self.enabled = enabled
+            self.batch_size = batch_size
+            self.pending = {}
+            self._token = None
+            self._request = None
+
+        def __enter__(self):
+            if self.enabled:
+                self._request = current_request.get()
+                self._token = current_request.set(None)
+                System.Changelog.active = self
+            return self
+
+        def __exit__(self, *args):
+            if self.enabled:
+                self.flush()
+                current_request.reset(self._token)
+                System.Changelog.active = None
+
+        @classmethod
+        def record(cls, obj, action="update"):
+            """
+            Record an object that was changed by the plugin
+
+            Deletes are recorded before deleting, with the current state.
+            """
+            self = cls.active
+            if self is None or obj is None:
+                return
+            # Flushed before adding, so a failed delete can still be discarded
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+            key = (obj._meta.label_lower, obj.pk)
+            if action == "delete":
+                # Built now, the object loses its primary key when deleted
+                obj.snapshot()
+                change = obj.to_objectchange(ObjectChangeActionChoices.ACTION_DELETE)
+                self.pending[key] = (obj, action, change)
+            else:
+                self.pending.setdefault(key, (obj, action, None))
+
+        @classmethod
+        def discard(cls, obj):
+            """
+            Forget a recorded change that didn't happen, e.g. a refused delete
+            """
+            self = cls.active
+            if self is not None and obj is not None:
+                self.pending.pop((obj._meta.label_lower, obj.pk), None)
+
+        def flush(self):
+            """
+            Write pending summary changes in bulk
+            """
+            if len(self.pending) == 0:
+                return
+            actions = {
+                "create": ObjectChangeActionChoices.ACTION_CREATE,
+                "update": ObjectChangeActionChoices.ACTION_UPDATE,
+                "delete": ObjectChangeActionChoices.ACTION_DELETE,
+            }
+            user = getattr(self._request, "user", None)
+            if user is not None and not user.is_authenticated:
+                user = None
+            request_id = getattr(self._request, "id", None) or uuid.uuid4()
+            changes = []
+            for obj, action, change in self.pending.values():
+                if change is None:
+                    change = obj.to_objectchange(actions[action])
+                change.user = user
+                change.user_name = user.username if user else "netbox_ciscodnac_plugin"
+                change.request_id = request_id
+                changes.append(change)
+            ObjectChange.objects.bulk_create(changes, batch_size=self.batch_size)
+            self.pending = {}
+
+    class Progress:
+        """
+        Sync progress published in the meta of the running RQ Job
+
+        The compact progress document is saved every `every` records, on each
+        page fetched from Cisco DNA Center and when a phase starts. Outside of
+        an RQ Job, progress is only counted.
+        """
+
+        active = None
+
+        def __init__(self, job, every):
+            self.job = job
+            self.every = every
+            self.state = {}
+            self.started = time.monotonic()
+            self.pending = 0
+
+        @classmethod
+        def get(cls):
+            job = get_current_job()
+            # Background threads (no job) count into the progress of the job
+            if cls.active is None or (
+                job is not None and getattr(cls.active.job, "id", None) != job.id
+            ):
+                cls.active = cls(job, System.Config.get("progress_every", 100))
+            return cls.active
+
+        @classmethod
+        def phase(cls, phase, tenant=None):
+            """
+            Start a new phase (e.g. sites or devices of a Cisco DNA Center)
+            """
+            self = cls.get()
+            errors = self.state.get("errors", 0)
+            self.state = {
+                "phase": phase,
+                "tenant": tenant,
+                "pages": 0,
+                "processed": 0,
+                "total": None,
+                "errors": errors,
+                "eta": None,
+            }
+            self.started = time.monotonic()
+            self.publish()
+
+        @classmethod
+        def total(cls, total):
+            self = cls.get()
+            self.state["total"] = total
+            self.publish()
+
+        @classmethod
+        def page(cls):
+            self = cls.get()
+            self.state["pages"] = self.state.get("pages", 0) + 1
+            self.publish()
+
+        @classmethod
+        def step(cls, count=1, error=False):
+            """
+            Count processed records, published every `every` records
+            """
+            self = cls.get()
+            self.state["processed"] = self.state.get("processed", 0) + count
+            if error:
+                self.state["errors"] = self.state.get("errors", 0) + count
+            self.pending += count
+            if self.pending >= self.every:
+                self.publish()
+
+        def publish(self):
+            self.pending = 0
+            total = self.state.get("total")
+            processed = self.state.get("processed", 0)
+            if total and processed:
+                elapsed = time.monotonic() - self.started
+                self.state["eta"] = round(
+                    elapsed / processed * max(total - processed, 0), 1
+                )
+            self.state["updated"] = time.time()
+            if self.job is None:
+                return
+            self.job.meta["progress"] = self.state
+            self.job.save_meta()
+
+    class Deadline:
+        """
+        Time budget of a sync phase (seconds, None or 0 is unlimited)
+
+        A phase that reaches its deadline keeps what is written, stops and
+        skips the purge, instead of being killed by the RQ job timeout.
+        """
+
+        def __init__(self, seconds=None):
+            self.seconds = seconds
+            self.end = time.monotonic() + seconds if seconds else None
+
+        @classmethod
+        def phase(cls, name, **kwargs):
+            deadlines = kwargs.get("deadlines") or System.Config.get("deadlines", {})
+            return cls((deadlines or {}).get(name))
+
+        def expired(self):
+            return self.end is not None and time.monotonic() >= self.end
+
+    class Profiler:
+        """
+        Profile sync phases with cProfile and tracemalloc
+
+        Reports are stored in the cache as a downloadable artifact per `key`
+        (RQ Job ID for background tasks).
+        """
+
+        def __init__(self, key=None):
+            if key is True:
+                job = get_current_job()
+                key = job.id if job is not None else str(uuid.uuid4())
+            self.key = key
+
+        @staticmethod
+        def cache_key(key):
+            return "netbox_ciscodnac_plugin_profile_{}".format(key)
+
+        @classmethod
+        def report(cls, key):
+            """
+            Get stored profile reports (one per phase)
+            """
+            return cache.get(cls.cache_key(key))
+
+        @classmethod
+        def exists(cls, key):
+            """
+            Check for stored profile reports without loading them
+            """
+            return cache.has_key(cls.cache_key(key))
+
+        @classmethod
+        def text(cls, reports):
+            """
+            Render stored profile reports as plain text
+            """
+            lines = []
+            for report in reports:
+                lines.append("=" * 79)
+                lines.append(
+                    "Phase: {} - {}s - peak memory {} KiB".format(
+                        report["phase"],
+                        report["duration"],
+                        report["peak_memory"] // 1024,
+                    )
+                )
+                lines.append("=" * 79)
+                lines.append("")
+                lines.append("Top allocation sites:")
+                lines.extend(report["allocations"])
+                lines.append("")
+                lines.append("Top functions (cumulative):")
+                lines.append(report["functions"])
+            return "\n".join(lines)
+
+        @classmethod
+        def profiled(cls, phase):
+            """
+            Decorator to profile a sync phase when called with `profile=<key>`
+            """
+
+            def decorator(func):
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    with cls(kwargs.get("profile")).phase(phase):
+                        return func(*args, **kwargs)
+
+                return wrapper
+
+            return decorator
+
+        @contextmanager
+        def phase(self, name):
+            if not self.key:
+                yield self
+                return
+
+            # Keep tracing enabled elsewhere (e.g. PYTHONTRACEMALLOC) untouched
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start(25)
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            profile = cProfile.Profile()
+            started = time.monotonic()
+            profile.enable()
+            try:
+                yield self
+            finally:
+                profile.disable()
+                duration = time.monotonic() - started
+                after = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                if not tracing:
+                    tracemalloc.stop()
+
+                # Top functions by cumulative time
+                functions = io.StringIO()
+                stats = pstats.Stats(profile, stream=functions)
+                stats.sort_stats("cumulative").print_stats(40)
+
+                # Top allocation sites during the phase
+                allocations = [
+                    str(stat) for stat in after.compare_to(before, "lineno")[0:25]
+                ]
+
+                reports = self.report(self.key) or []
+                reports.append(
+                    {
+                        "phase": name,
+                        "duration": round(duration, 2),
+                        "peak_memory": peak,
+                        "functions": functions.getvalue(),
+                        "allocations": allocations,
+                        "pstats": marshal.dumps(stats.stats),
+                    }
+                )
+                cache.set(self.cache_key(self.key), reports, timeout=86400)
+
@@ -21,6 +21,7 @@ class SettingsTable(NetBoxTable):
     version = tables.Column()
     verify = columns.BooleanColumn()
     status = columns.BooleanColumn()
+    priority = tables.Column()
 
     class Meta(NetBoxTable.Meta):
         model = Settings
@@ -32,4 +33,5 @@ class SettingsTable(NetBoxTable):
             "version",
             "verify",
             "status",
+            "priority",
         ]
@@ -0,0 +1,66 @@
+from decimal import Decimal
+from django.test import TestCase
+from dcim.models import Location, Region, Site
+from netbox_ciscodnac_plugin.models import Settings
+from netbox_ciscodnac_plugin.netbox_ciscodnac_plugin.netbox import Netbox
+from .utils import Record
+
+
+class HierarchySyncTest(TestCase):
+    """
+    Site tree synced as Regions, Sites and Locations, created then updated
+    """
+
+    tenant = "dnac.example.com"
+
+    def setUp(self):
+        Settings.objects.create(
+            hostname=self.tenant, username="admin", password="admin", version="2.3.7.6"
+        )
+        Netbox.Sync.tenants(
+            task="system", tenant=self.tenant, slug=self.tenant.replace(".", "-")
+        )
+        self.tag = Netbox.Sync.tags(task="system")
+
+    def site(self, id, parent, hierarchy, type=None, **attributes):
+        additional = []
+        if type is not None:
+            location = {"type": type, "address": None, "latitude": None, "longitude": None}
+            location.update(attributes)
+            additional.append({"nameSpace": "Location", "attributes": location})
+        return Record(
+            id=id,
+            parentId=parent,
+            name=hierarchy.split("/")[-1],
+            siteNameHierarchy=hierarchy,
+            additionalInfo=additional,
+        )
+
+    def sites(self, latitude):
+        return [
+            self.site("global", None, "Global"),
+            self.site("area", "global", "Global/Area", "area"),
+            self.site(
+                "building", "area", "Global/Area/Building", "building", latitude=latitude
+            ),
+            self.site("floor", "building", "Global/Area/Building/Floor", "floor"),
+        ]
+
+    def sync(self, latitude):
+        return Netbox.Hierarchy.sync(
+            tenant=self.tenant, sites=self.sites(latitude), tag=self.tag
+        )
+
+    def test_create_then_update(self):
+        results = self.sync("10.5")
+        self.assertEqual({r["sync_status"] for r in results}, {"Created"})
+
+        results = self.sync("11.5")
+        self.assertEqual({r["sync_status"] for r in results}, {"Updated"})
+
+        self.assertEqual(Region.objects.count(), 2)
+        self.assertEqual(Location.objects.count(), 1)
+        site = Site.objects.get(slug="building")
+        self.assertEqual(site.latitude, Decimal("11.500000"))
+        self.assertEqual(Location.objects.get(slug="floor").site, site)
+        self.assertEqual(Region.objects.get(slug="area").parent.name, self.tenant)
@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+from django.test import SimpleTestCase
+
+# Modules only loaded once a Cisco DNA Center is called
+HEAVY = ["dnacentersdk"]
+
+SCRIPT = """
+import json, sys
+import django
+
+django.setup()
+import netbox_ciscodnac_plugin.views
+from netbox_ciscodnac_plugin.netbox_ciscodnac_plugin import CiscoDNAC
+
+print(json.dumps({
+    "modules": [m for m in %r if m in sys.modules],
+    "sessions": len(CiscoDNAC.sessions),
+    "api": CiscoDNAC._api is not None,
+}))
+"""
+
+
+class ImportTest(SimpleTestCase):
+    """
+    Loading the URLconf doesn't import dnacentersdk or open HTTP sessions
+    """
+
+    def test_import(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(sys.path)
+        env.setdefault("DJANGO_SETTINGS_MODULE", "netbox.settings")
+        output = subprocess.run(
+            [sys.executable, "-c", SCRIPT % HEAVY],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+
+        self.assertEqual(result["modules"], [])
+        self.assertEqual(result["sessions"], 0)
+        self.assertFalse(result["api"])
@@ -0,0 +1,71 @@
+from django.test import TestCase
+from dcim.models import Device, Site
+from netbox_ciscodnac_plugin.models import Settings
+from netbox_ciscodnac_plugin.netbox_ciscodnac_plugin.data import Data
+from netbox_ciscodnac_plugin.netbox_ciscodnac_plugin.netbox import Netbox
+from .utils import Record
+
+
+class DeviceOwnerTest(TestCase):
+    """
+    A Device reported by two Cisco DNA Centers is written by its owner only
+    """
+
+    owner = "dnac-a.example.com"
+    other = "dnac-b.example.com"
+    serial = "FOC00000001"
+
+    def setUp(self):
+        self.tag = Netbox.Sync.tags(task="system")
+        self.sites = {}
+        for priority, tenant in enumerate([self.owner, self.other]):
+            Settings.objects.create(
+                hostname=tenant,
+                username="admin",
+                password="admin",
+                version="2.3.7.6",
+                priority=priority,
+            )
+            __tenant = Netbox.Sync.tenants(
+                task="system", tenant=tenant, slug=tenant.replace(".", "-")
+            )
+            site = "site-{}".format(tenant.split(".")[0])
+            Site.objects.create(name=tenant, slug=site, tenant=__tenant)
+            self.sites[tenant] = site
+
+    def device(self):
+        return Record(
+            id="device-1",
+            hostname="switch-1",
+            serialNumber=self.serial,
+            managementIpAddress="10.0.0.1",
+            platformId="C9300-48P",
+            softwareVersion="17.9.4",
+            family="Switches and Hubs",
+            type="Cisco Catalyst 9300 Switch",
+            role="ACCESS",
+            reachabilityStatus="Reachable",
+            deviceSupportLevel="Supported",
+        )
+
+    def upsert(self, tenant):
+        return Data.upsert_devices(
+            tenant=tenant,
+            devices=[self.device()],
+            site_members={self.serial: self.sites[tenant]},
+            tag=self.tag,
+            owners={self.serial: self.owner},
+        )
+
+    def test_only_owner_writes_device(self):
+        rows = self.upsert(self.other)
+        self.assertEqual(rows[0]["sync_status"], "Skipped: owned by {}".format(self.owner))
+        self.assertFalse(Device.objects.filter(serial=self.serial).exists())
+
+        self.upsert(self.owner)
+        self.assertEqual(Device.objects.get(serial=self.serial).tenant.name, self.owner)
+
+        # The other Cisco DNA Center doesn't take the Device over
+        self.upsert(self.other)
+        self.assertEqual(Device.objects.get(serial=self.serial).tenant.name, self.owner)
+        self.assertEqual(Device.objects.filter(serial=self.serial).count(), 1)
@@ -0,0 +1,6 @@
+class Record(dict):
+    """
+    Cisco DNA Center API record, fields as attributes
+    """
+
+    __getattr__ = dict.get
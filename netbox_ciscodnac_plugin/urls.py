@@ -29,6 +29,8 @@ urlpatterns = (
     path("<int:pk>/devices/", views.DeviceView.as_view(), name="devices"),
     path("sites/", views.SitesView.as_view(), name="sites"),
     path("<int:pk>/sites/", views.SitesView.as_view(), name="sites"),
+    path("export/<str:object_type>/", views.Export.as_view(), name="export"),
+    path("<int:pk>/export/<str:object_type>/", views.Export.as_view(), name="export"),
     
     # Sync
     path("sync/full/", views.SyncFull.as_view(), name="sync_full"),
@@ -39,6 +41,10 @@ urlpatterns = (
         name="sync_full_failed",
     ),
     path("sync/<int:pk>/full/", views.SyncFull.as_view(), name="sync_full"),
+    path("sync/<int:pk>/subtree/", views.SyncSubtree.as_view(), name="sync_subtree"),
+    path("sync/<uuid:id>/profile/", views.SyncProfile.as_view(), name="sync_profile"),
+    path("sync/plan/", views.SyncPlan.as_view(), name="sync_plan"),
+    path("sync/<int:pk>/plan/", views.SyncPlan.as_view(), name="sync_plan"),
     path("sync/sites/", views.SyncSites.as_view(), name="sync_sites"),
     path("sync/<int:pk>/sites/", views.SyncSites.as_view(), name="sync_sites"),
     path(
@@ -52,9 +58,21 @@ urlpatterns = (
         name="sync_devices",
     ),
     
+    # Results
+    path("sync/results/", views.SyncResults.as_view(), name="sync_results"),
+
     # Jobs
     path("job/<uuid:id>/", views.JobStatus.as_view(), name="job_status"),
     
+    # Webhook
+    path("webhook/", views.Webhook.as_view(), name="webhook"),
+    path("webhook/<int:pk>/", views.Webhook.as_view(), name="webhook"),
+
     # Purge
     path("purge/<int:pk>/tenant/", views.PurgeTenant.as_view(), name="purge_tenant"),
+    path(
+        "purge/<uuid:id>/",
+        views.PurgeTenantResult.as_view(),
+        name="purge_tenant_result",
+    ),
 )
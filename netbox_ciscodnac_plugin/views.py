@@ -1,22 +1,61 @@
+import csv
+import hmac
+import json
+import uuid
 import platform
 from django.conf import settings
-from django.http import Http404, HttpResponseServerError, JsonResponse
+from django.core.cache import cache
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseServerError,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.core.paginator import Paginator
 from django.views.defaults import ERROR_500_TEMPLATE_NAME
 from django.template import loader
 from django.urls import reverse
 from django.shortcuts import get_object_or_404, render, redirect
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 from utilities.forms import ConfirmationForm
+from utilities.paginator import get_paginate_count
 from tenancy.models import Tenant
 from netbox.views import generic
 from .models import Settings
 from .forms import SettingsForm
 from .tables import SettingsTable
-from .netbox_ciscodnac_plugin.data import Data
+from .netbox_ciscodnac_plugin.data import Data, event_sync
 from .netbox_ciscodnac_plugin.netbox import Netbox
 from .netbox_ciscodnac_plugin.utilities import System
 
 
+def rq_error():
+    """
+    Error page when no RQ workers are running for Background Tasks
+    """
+    template = loader.get_template(ERROR_500_TEMPLATE_NAME)
+    error_msg = """
+    Addtional Workers not running for Background Tasks.
+    Verify that rqworker is running for the queues of the plugin
+    (`queues` in PLUGINS_CONFIG, e.g. `manage.py rqworker high default low`).
+    """
+    return HttpResponseServerError(
+        template.render(
+            {
+                "error": error_msg,
+                "exception": "netbox_ciscodnac_plugin plugin - RQ",
+                "netbox_version": settings.VERSION,
+                "python_version": platform.python_version(),
+            }
+        )
+    )
+
+
 class SettingsView(generic.ObjectListView):
     """
     Cisco DNA Center Settings
@@ -92,22 +131,12 @@ class SyncFull(View):
             return redirect("/plugins/netbox_ciscodnac_plugin/settings/")
 
         # Check if RQ workers are running
-        if System.RQ.status() is False:
-            template = loader.get_template(ERROR_500_TEMPLATE_NAME)
-            error_msg = """
-            Addtional Workers not running for Background Tasks.
-            Verify that rqworker is running.
-            """
-            return HttpResponseServerError(
-                template.render(
-                    {
-                        "error": error_msg,
-                        "exception": "netbox_ciscodnac_plugin plugin - RQ",
-                        "netbox_version": settings.VERSION,
-                        "python_version": platform.python_version(),
-                    }
-                )
-            )
+        if System.RQ.status("low") is False:
+            return rq_error()
+
+        # Profile sync phases (opt-in)
+        if "id" not in kwargs and request.GET.get("profile"):
+            kwargs["profile"] = True
 
         # Run Sync as Background Job in RQ
         data = Data.sync_full(**kwargs)
@@ -119,6 +148,8 @@ class SyncFull(View):
                 "netbox_ciscodnac_plugin/sync_full.html",
                 {
                     "data": data,
+                    "profile": System.Profiler.exists(str(kwargs["id"])),
+                    "id": kwargs["id"],
                 },
             )
         return render(
@@ -126,6 +157,47 @@ class SyncFull(View):
             "netbox_ciscodnac_plugin/loading_job.html",
             {
                 "data": data,
+                "finished_url": reverse(
+                    "plugins:netbox_ciscodnac_plugin:sync_full", kwargs={"id": data["id"]}
+                ),
+                "failed_url": reverse(
+                    "plugins:netbox_ciscodnac_plugin:sync_full_failed",
+                    kwargs={"id": data["id"]},
+                ),
+            },
+        )
+
+
+class SyncSubtree(View):
+    """
+    Sync a site subtree of a Cisco DNA Center (`?site=<uuid>` or `?prefix=<hierarchy>`)
+    """
+
+    def get(self, request, pk):
+        get_object_or_404(Settings, pk=pk)
+        site = request.GET.get("site")
+        prefix = request.GET.get("prefix")
+        if not site and not prefix:
+            return HttpResponseBadRequest()
+
+        # Check if RQ workers are running
+        if System.RQ.status("high") is False:
+            return rq_error()
+
+        # Run Sync as Background Job in RQ, results are stored per Job ID
+        data = Data.enqueue_subtree(pk=pk, site=site or None, prefix=prefix or None)
+        return render(
+            request,
+            "netbox_ciscodnac_plugin/loading_job.html",
+            {
+                "data": data,
+                "finished_url": "{}?run={}".format(
+                    reverse("plugins:netbox_ciscodnac_plugin:sync_results"), data["id"]
+                ),
+                "failed_url": reverse(
+                    "plugins:netbox_ciscodnac_plugin:sync_full_failed",
+                    kwargs={"id": data["id"]},
+                ),
             },
         )
 
@@ -152,12 +224,80 @@ class JobStatus(View):
     """
 
     def get(self, request, id):
-        data = Data.job_status(id)
+        # Optional long-poll: `?wait=<seconds>&since=<progress.updated>`
+        try:
+            wait = max(int(request.GET.get("wait", 0)), 0)
+        except ValueError:
+            return HttpResponseBadRequest()
+        data = Data.job_status(id, wait=wait, since=request.GET.get("since"))
         if data is None:
             raise Http404()
         return JsonResponse(data)
 
 
+class SyncResults(View):
+    """
+    Stored sync results, paginated and filtered
+    """
+
+    def get(self, request):
+        filters = {
+            k: request.GET.get(k)
+            for k in ["run", "tenant", "object_type", "sync_status", "q"]
+        }
+        paginator = Paginator(Data.results(**filters), get_paginate_count(request))
+        page = paginator.get_page(request.GET.get("page"))
+
+        # Keep the filters in the pagination links
+        params = request.GET.copy()
+        params.pop("page", None)
+        return render(
+            request,
+            "netbox_ciscodnac_plugin/sync_results.html",
+            {
+                "page": page,
+                "filters": filters,
+                "querystring": params.urlencode(),
+                "tenants": Settings.objects.values_list("hostname", flat=True),
+                "object_types": ["site", "device", "area", "building", "floor"],
+                "sync_statuses": ["Created", "Updated", "Error"],
+                "profile": bool(filters["run"]) and System.Profiler.exists(filters["run"]),
+            },
+        )
+
+
+class SyncProfile(View):
+    """
+    Download profile report of a sync
+    """
+
+    def get(self, request, id):
+        reports = System.Profiler.report(str(id))
+        if reports is None:
+            raise Http404()
+
+        # Raw pstats of a single phase, e.g. for snakeviz
+        if "phase" in request.GET:
+            for report in reports:
+                if report["phase"] == request.GET["phase"]:
+                    response = HttpResponse(
+                        report["pstats"], content_type="application/octet-stream"
+                    )
+                    response["Content-Disposition"] = (
+                        'attachment; filename="ciscodnac-{}-{}.pstats"'.format(
+                            id, report["phase"]
+                        )
+                    )
+                    return response
+            raise Http404()
+
+        response = HttpResponse(
+            System.Profiler.text(reports), content_type="text/plain"
+        )
+        response["Content-Disposition"] = 'attachment; filename="ciscodnac-{}.txt"'.format(id)
+        return response
+
+
 class DeviceView(View):
     """
     Cisco DNA Center Devices
@@ -174,16 +314,84 @@ class DeviceView(View):
         )
 
 
+class Export(View):
+    """
+    Stream Cisco DNA Center Devices or Sites as CSV or JSON lines
+    """
+
+    class Echo:
+        """
+        File-like object for csv.writer, returns the line to stream it
+        """
+
+        def write(self, value):
+            return value
+
+    def get(self, request, object_type, **kwargs):
+        if object_type not in Data.EXPORT:
+            raise Http404()
+        if "pk" in kwargs:
+            get_object_or_404(Settings, pk=kwargs["pk"])
+
+        fmt = request.GET.get("format", "csv")
+        if fmt == "jsonl":
+            lines = self.jsonl(object_type, **kwargs)
+            content_type = "application/x-ndjson"
+        elif fmt == "csv":
+            lines = self.csv(object_type, **kwargs)
+            content_type = "text/csv"
+        else:
+            return HttpResponseBadRequest()
+
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        response["Content-Disposition"] = 'attachment; filename="ciscodnac-{}.{}"'.format(
+            object_type, fmt
+        )
+        return response
+
+    def csv(self, object_type, **kwargs):
+        columns = Data.EXPORT[object_type]
+        writer = csv.writer(self.Echo())
+        yield writer.writerow(["tenant"] + columns)
+        for tenant, record in Data.export(object_type, **kwargs):
+            yield writer.writerow([tenant] + [record.get(c) for c in columns])
+
+    def jsonl(self, object_type, **kwargs):
+        for tenant, record in Data.export(object_type, **kwargs):
+            yield json.dumps(dict(record, tenant=tenant), default=str) + "\n"
+
+
 class SyncDevices(View):
     """
     Sync Cisco DNA Center Devices
     """
 
     def get(self, request, **kwargs):
+        run = uuid.uuid4()
+
+        # Profile sync phase (opt-in)
+        if request.GET.get("profile"):
+            kwargs["profile"] = str(run)
+
         data = Data.sync_devices(**kwargs)
+        Data.store_results(run=run, object_type="device", data=data)
+        return redirect(
+            "{}?run={}".format(
+                reverse("plugins:netbox_ciscodnac_plugin:sync_results"), run
+            )
+        )
+
+
+class SyncPlan(View):
+    """
+    Plan Cisco DNA Center Sync (dry-run)
+    """
+
+    def get(self, request, **kwargs):
+        data = Data.sync_plan(**kwargs)
         return render(
             request,
-            "netbox_ciscodnac_plugin/sync_devices.html",
+            "netbox_ciscodnac_plugin/sync_plan.html",
             {
                 "data": data,
             },
@@ -212,13 +420,18 @@ class SyncSites(View):
     """
 
     def get(self, request, **kwargs):
+        run = uuid.uuid4()
+
+        # Profile sync phase (opt-in)
+        if request.GET.get("profile"):
+            kwargs["profile"] = str(run)
+
         data = Data.sync_sites(**kwargs)
-        return render(
-            request,
-            "netbox_ciscodnac_plugin/sync_sites.html",
-            {
-                "data": data,
-            },
+        Data.store_results(run=run, object_type="site", data=data)
+        return redirect(
+            "{}?run={}".format(
+                reverse("plugins:netbox_ciscodnac_plugin:sync_results"), run
+            )
         )
 
 
@@ -248,8 +461,41 @@ class PurgeTenant(View):
 
     def post(self, request, **kwargs):
 
-        # Delete Tenant in NetBox
+        # Verify that the Tenant exists in NetBox
+        get_object_or_404(Tenant, pk=kwargs["pk"], tags=System.PluginTag.get())
+
+        # Check if RQ workers are running
+        if System.RQ.status("low") is False:
+            return rq_error()
+
+        # Delete Tenant in NetBox as Background Job in RQ
         data = Data.purge_tenant(**kwargs)
+        return render(
+            request,
+            "netbox_ciscodnac_plugin/loading_job.html",
+            {
+                "data": data,
+                "finished_url": reverse(
+                    "plugins:netbox_ciscodnac_plugin:purge_tenant_result",
+                    kwargs={"id": data["id"]},
+                ),
+                "failed_url": reverse(
+                    "plugins:netbox_ciscodnac_plugin:sync_full_failed",
+                    kwargs={"id": data["id"]},
+                ),
+            },
+        )
+
+
+class PurgeTenantResult(View):
+    """
+    Display result of a Tenant purge RQ Job
+    """
+
+    def get(self, request, id):
+        data = Data.job_result(id)
+        if data is None:
+            raise Http404()
         return render(
             request,
             "netbox_ciscodnac_plugin/purge_tenant.html",
@@ -257,3 +503,67 @@ class PurgeTenant(View):
                 "data": data,
             },
         )
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class Webhook(View):
+    """
+    Receive Cisco DNA Center Event Notifications and sync the affected object
+    """
+
+    def post(self, request, **kwargs):
+
+        # Verify shared secret (webhook is disabled without a secret)
+        secret = System.Config.get("webhook_secret")
+        token = request.headers.get("Authorization", "")
+        if token.lower().startswith("bearer "):
+            token = token[7:]
+        if not secret or not hmac.compare_digest(token.encode(), str(secret).encode()):
+            return HttpResponseForbidden()
+
+        try:
+            event = json.loads(request.body)
+        except ValueError:
+            return HttpResponseBadRequest("Invalid JSON")
+        if not isinstance(event, dict):
+            return HttpResponseBadRequest("Invalid event")
+
+        # Cisco DNA Center Instance by URL, else by the sender of the event
+        if "pk" in kwargs:
+            tenant = get_object_or_404(Settings, pk=kwargs["pk"], status=True)
+        else:
+            tenant = get_object_or_404(
+                Settings, hostname=event.get("dnacIP"), status=True
+            )
+
+        # Affected Device (UUID or IP Address) or Site
+        network = event.get("network") or {}
+        details = event.get("details") or {}
+        target = {}
+        if network.get("deviceId"):
+            target["device"] = network["deviceId"]
+        elif details.get("Device IP") or details.get("Device"):
+            target["address"] = System.Address.host(
+                details.get("Device IP") or details.get("Device")
+            )
+        elif network.get("siteId"):
+            target["site"] = network["siteId"]
+        if not any(target.values()):
+            return JsonResponse({"status": "ignored"}, status=202)
+
+        # Coalesce bursts of events for the same object into one job, while
+        # that job hasn't started (it reads the latest state when it runs)
+        key = "netbox_ciscodnac_plugin_event_{}_{}".format(
+            tenant.pk, "_".join(str(v) for v in target.values())
+        )
+        previous = cache.get(key)
+        if previous is not None:
+            j = System.RQ.fetch_job(previous)
+            if j is not None and j.get_status() == "queued":
+                return JsonResponse({"status": "queued", "id": previous}, status=202)
+        job = System.RQ.queue("high").enqueue_call(
+            event_sync, kwargs=dict(target, pk=tenant.pk)
+        )
+        cache.set(key, job.id, timeout=300)
+        return JsonResponse({"status": "queued", "id": str(job.id)}, status=202)
+